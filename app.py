@@ -1,13 +1,15 @@
 import streamlit as st
-import json
-import PyPDF2
 import io
-from model import get_output
+from model import stream_output, syllabus_report
+from tracing import trace
 import base64
 from datetime import datetime
 import time
 import re
-from history_manager import HistoryManager
+from shared_resources import get_history_manager, get_job_queue, get_templates
+from pdf_export import pdf_download_button
+from pdf_text import extract_text
+from paper_model import Paper, parse_paper
 
 # Set wide layout and custom theme
 st.set_page_config(
@@ -148,31 +150,12 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-def load_templates():
-    try:
-        with open("templates.json", "r") as f:
-            templates = json.load(f)
-    except FileNotFoundError:
-        templates = {}
-    return templates
-
-
-def save_templates(templates):
-    with open("templates.json", "w") as f:
-        json.dump(templates, f, indent=4)
-
-
 def extract_text_from_pdf(pdf_file):
     try:
-        from PyPDF2 import PdfFileReader
-        pdf_reader = PdfFileReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extractText()
-        
-        # Clean up the extracted text
-        text = text.strip()
-        text = ' '.join(text.split())  # Remove extra whitespace
+        # Cached by content hash, so reruns with the same upload skip extraction
+        text, pages_read, total_pages = extract_text(pdf_file.getvalue())
+        if pages_read < total_pages:
+            st.warning(f"Only the first {pages_read} of {total_pages} pages were read.")
         return text
     except Exception as e:
         st.error(f"Error reading PDF: {str(e)}")
@@ -193,175 +176,39 @@ def generate_prompt(num_mcq, num_3_marks, num_5_marks, difficulty_level, syllabu
     return requirements
 
 
-def convert_to_pdf(content):
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-    from reportlab.lib.units import inch
-    from reportlab.lib.colors import HexColor
-    from io import BytesIO
-    import re
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=letter,
-        rightMargin=72,
-        leftMargin=72,
-        topMargin=72,
-        bottomMargin=72
-    )
-    
-    # Create styles with better formatting
-    styles = getSampleStyleSheet()
-    
-    custom_styles = {
-        'Title': ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
-            spaceAfter=30,
-            alignment=1,
-            textColor=HexColor('#2c3e50'),
-            fontName='Helvetica-Bold'
-        ),
-        'Header': ParagraphStyle(
-            'CustomHeader',
-            parent=styles['Normal'],
-            fontSize=12,
-            spaceAfter=20,
-            alignment=1,
-            textColor=HexColor('#34495e'),
-            fontName='Helvetica'
-        ),
-        'Section': ParagraphStyle(
-            'CustomSection',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceBefore=20,
-            spaceAfter=20,
-            textColor=HexColor('#2c3e50'),
-            fontName='Helvetica-Bold'
-        ),
-        'Question': ParagraphStyle(
-            'CustomQuestion',
-            parent=styles['Normal'],
-            fontSize=12,
-            leading=16,
-            spaceBefore=12,
-            spaceAfter=12,
-            leftIndent=20,
-            fontName='Times-Roman'
-        ),
-        'Option': ParagraphStyle(
-            'CustomOption',
-            parent=styles['Normal'],
-            fontSize=12,
-            leading=14,
-            leftIndent=40,
-            spaceBefore=2,
-            spaceAfter=2,
-            fontName='Times-Roman'
-        ),
-        'Answer': ParagraphStyle(
-            'CustomAnswer',
-            parent=styles['Normal'],
-            fontSize=12,
-            leading=16,
-            leftIndent=40,
-            spaceBefore=6,
-            spaceAfter=12,
-            fontName='Times-Roman'
-        )
-    }
-    
-    def clean_html(text):
-        # Convert <b> tags to reportlab bold
-        text = text.replace('<b>', '<b>')
-        text = text.replace('</b>', '</b>')
-        # Handle other HTML-like formatting
-        text = text.replace('&lt;', '<')
-        text = text.replace('&gt;', '>')
-        text = text.replace('&amp;', '&')
-        text = text.replace('**', '')
-        return text
-    
-    def format_mcq(text):
-        # Format MCQ options to look better
-        text = re.sub(r'\b([a-d])\)', r'\1) ', text)  # Add space after option letters
-        text = re.sub(r'\s{2,}', ' ', text)  # Remove extra spaces
-        return text
-    
-    story = []
-    
-    # Split content into lines and process
-    lines = content.split('\n')
-    in_mcq_section = False
-    
-    for line in lines:
-        if not line.strip():
-            continue
-        
-        line = clean_html(line)
-        
-        if 'Question Paper' in line or 'Answer Key' in line:
-            story.append(Paragraph(line, custom_styles['Title']))
-            story.append(Spacer(1, 20))
-        elif 'Section' in line:
-            in_mcq_section = 'Multiple Choice' in line
-            story.append(Paragraph(line, custom_styles['Section']))
-            story.append(Spacer(1, 10))
-        elif line.startswith('Time:') or line.startswith('Max. Marks:') or line.startswith('Instructions:'):
-            story.append(Paragraph(line, custom_styles['Header']))
-        elif line.strip().startswith(('Q', '1.', '2.', '3.', '4.', '5.')):
-            if in_mcq_section:
-                line = format_mcq(line)
-            story.append(Paragraph(line, custom_styles['Question']))
-        else:
-            story.append(Paragraph(line, custom_styles['Answer']))
-            story.append(Spacer(1, 6))
-    
-    try:
-        doc.build(story)
-    except Exception as e:
-        st.error(f"Error building PDF: {str(e)}")
-        # Fallback to simpler formatting
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        story = [Paragraph(line, styles['Normal']) for line in content.split('\n') if line.strip()]
-        doc.build(story)
-    
-    buffer.seek(0)
-    return buffer
-
-
-def generate_download_buttons(questions, answers, key_prefix=""):
+def generate_download_buttons(questions, answers, key_prefix="", paper=None):
     col1, col2, col3 = st.columns(3)
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if paper:
+        # Structured papers go to the PDF builder as is instead of being re-parsed from markdown
+        structured = Paper.from_dict(paper)
+        questions = structured.questions_only()
+        answers = structured.answers_only() if answers else None
     
     with col1:
-        # Add unique key for each download button
-        st.download_button(
+        # PDFs are built lazily and cached by content hash
+        pdf_download_button(
             "📄 Download Question Paper",
-            convert_to_pdf(questions).getvalue(),  # Convert to PDF
+            questions,
             f"question_paper_{timestamp}.pdf",
-            mime="application/pdf",
             key=f"{key_prefix}_question_paper"
         )
 
     with col2:
         if answers:
-            st.download_button(
+            pdf_download_button(
                 "✅ Download Answer Key",
-                convert_to_pdf(answers).getvalue(),  # Convert to PDF
+                answers,
                 f"answer_key_{timestamp}.pdf",
-                mime="application/pdf",
                 key=f"{key_prefix}_answer_key"
             )
     
     with col3:
         if st.button("🔄 Reset", key=f"{key_prefix}_reset"):
+            if st.session_state.get('job_id'):
+                get_job_queue().cancel(st.session_state.job_id)
+                st.query_params.pop("job", None)
             # Only clear form inputs, not generated content
             for key in list(st.session_state.keys()):
                 if key not in ['generated_content']:
@@ -369,9 +216,76 @@ def generate_download_buttons(questions, answers, key_prefix=""):
             st.experimental_rerun()
 
 
-def store_in_history(questions, answers, metadata):
-    history_manager = HistoryManager()
-    history_manager.add_paper(questions, answers, metadata)
+def show_generated_content(questions, answers):
+    if not answers:
+        st.markdown(questions)
+        return
+
+    tab1, tab2 = st.tabs(["📝 Question Paper", "✅ Answer Key"])
+    
+    with tab1:
+        st.markdown("### Question Paper")
+        st.markdown(questions)
+    
+    with tab2:
+        st.markdown("### Answer Key")
+        st.markdown(answers)
+
+
+def render_streamed_output(requirements, progress_bar):
+    """Render the paper while it streams in and return the combined output"""
+    tab1, tab2 = st.tabs(["📝 Question Paper", "✅ Answer Key"])
+    with tab1:
+        st.markdown("### Question Paper")
+        questions_placeholder = st.empty()
+    with tab2:
+        st.markdown("### Answer Key")
+        answers_placeholder = st.empty()
+
+    placeholders = {"questions": questions_placeholder, "answers": answers_placeholder}
+    parts = {"questions": "", "answers": ""}
+    for kind, chunk in stream_output(requirements):
+        parts[kind] += chunk
+        placeholders[kind].markdown(parts[kind])
+        progress_bar.progress(70 if kind == "questions" else 90)
+
+    separator = "=" * 50
+    output = "Question Paper\n" + separator + "\n\n" + parts["questions"].strip()
+    if parts["answers"]:
+        output += "\n\nAnswer Key\n" + separator + "\n\n" + parts["answers"].strip()
+    return output
+
+
+@st.fragment(run_every=2)
+def show_job_status(job_id):
+    """Poll a queued generation and show the paper once its worker is done"""
+    job = get_job_queue().status(job_id)
+    if job is None:
+        st.session_state.job_id = None
+        st.query_params.pop("job", None)
+        return
+
+    if job['status'] == "queued":
+        st.info(f"⏳ Waiting for a worker ({job.get('position', 0)} ahead of this paper)...")
+    elif job['status'] in ("running", "cancelling"):
+        st.info(f"🔄 Generating your question paper... {time.time() - job['started_at']:.0f}s")
+    else:
+        st.session_state.job_id = None
+        st.query_params.pop("job", None)
+        if job['status'] == "done":
+            paper = get_history_manager().get_paper(job['paper_id'])
+            if paper:
+                st.session_state.generated_content = {
+                    'questions': paper['questions'], 'answers': paper['answers'], 'paper': paper.get('paper')
+                }
+        elif job['status'] == "failed":
+            st.session_state.job_error = job['error']
+        # Redraw the whole page with the result
+        st.rerun()
+
+
+def store_in_history(questions, answers, metadata, paper=None):
+    get_history_manager().add_paper(questions, answers, metadata, paper=paper.to_dict() if paper else None)
 
 
 def show_history():
@@ -385,22 +299,21 @@ def show_history():
                 
                 with tab1:
                     st.markdown(paper['questions'])
-                    st.download_button(
+                    structured = Paper.from_dict(paper['paper']) if paper.get('paper') else None
+                    pdf_download_button(
                         "📄 Download Question Paper",
-                        convert_to_pdf(paper['questions']).getvalue(),
+                        structured.questions_only() if structured else paper['questions'],
                         f"question_paper_{paper['timestamp']}.pdf",
-                        mime="application/pdf",
                         key=f"history_{i}_question"
                     )
                 
                 if paper['answers']:
                     with tab2:
                         st.markdown(paper['answers'])
-                        st.download_button(
+                        pdf_download_button(
                             "✅ Download Answer Key",
-                            convert_to_pdf(paper['answers']).getvalue(),
+                            structured.answers_only() if structured else paper['answers'],
                             f"answer_key_{paper['timestamp']}.pdf",
-                            mime="application/pdf",
                             key=f"history_{i}_answer"
                         )
 
@@ -409,6 +322,9 @@ def main():
     # Initialize session state for storing generated content
     if 'generated_content' not in st.session_state:
         st.session_state.generated_content = None
+    # Pick a running job back up after a browser refresh
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = st.query_params.get("job")
     
     # Initialize variables
     subject = ""
@@ -426,13 +342,19 @@ def main():
         <hr>
     """, unsafe_allow_html=True)
 
-    # Load templates
-    templates = load_templates()
+    # Load templates; shared across sessions and re-read only when templates.json changes
+    templates = get_templates()
     
     # Sidebar for template selection
     with st.sidebar:
         st.header("Templates")
         selected_template = st.selectbox("Select Template", ["Custom"] + list(templates.keys()), index=0)
+        generation_mode = st.radio(
+            "Generation Mode",
+            ["Streaming", "Parallel sections", "Standard"],
+            help="Streaming shows the paper as it is written; parallel sections reuses "
+                 "question bank entries and finishes long papers fastest"
+        )
         
         if st.button("Save Current as Template"):
             template_name = st.text_input("Template Name")
@@ -528,6 +450,7 @@ def main():
         include_answers = template.get("include_answers", True)
     
     # Paper generation 
+    just_generated = False
     if st.button("🎯 Generate Question Paper", type="primary"):
         if not syllabus_content:
             st.error("Please provide syllabus content before generating the paper.")
@@ -547,48 +470,69 @@ def main():
                 )
                 
                 progress_bar.progress(50)
-                output = get_output(requirements)
-                progress_bar.progress(100)
-
-                if output and "Answer Key" in output:
-                    questions, answers = output.split("Answer Key", 1)
-                    questions = questions.strip()
-                    answers = "Answer Key" + answers.strip()
-                    
-                    # Store in history
-                    metadata = {
-                        'subject': subject,
-                        'topic': selected_topic,
-                        'difficulty': difficulty_level,
-                        'total_marks': total_marks,
-                        'num_mcq': num_mcq,
-                        'num_3_marks': num_3_marks,
-                        'num_5_marks': num_5_marks
-                    }
-                    store_in_history(questions, answers, metadata)
-                    
-                    # Display current generation
-                    tab1, tab2 = st.tabs(["📝 Question Paper", "✅ Answer Key"])
-                    
-                    with tab1:
-                        st.markdown("### Question Paper")
-                        st.markdown(questions)
-                    
-                    with tab2:
-                        st.markdown("### Answer Key")
-                        st.markdown(answers)
-                    
-                    generate_download_buttons(questions, answers, "current")
-                elif output:
-                    store_in_history(output, None, None)
-                    st.markdown(output)
-                    generate_download_buttons(output, None, "current")
+                metadata = {
+                    'subject': subject,
+                    'topic': selected_topic,
+                    'difficulty': difficulty_level,
+                    'total_marks': total_marks,
+                    'num_mcq': num_mcq,
+                    'num_3_marks': num_3_marks,
+                    'num_5_marks': num_5_marks
+                }
+                report = syllabus_report(requirements, parallel=generation_mode == "Parallel sections")
+                if report['saved_tokens'] > 0:
+                    st.caption(
+                        f"Syllabus trimmed to its most relevant parts: ~{report['saved_tokens']:,} of "
+                        f"{report['original_tokens']:,} prompt tokens saved."
+                    )
+
+                if generation_mode != "Streaming":
+                    # Runs on a background worker, so reruns and refreshes don't lose the job
+                    job_id = get_job_queue().submit(
+                        requirements,
+                        mode="parallel" if generation_mode == "Parallel sections" else "standard",
+                        metadata=metadata
+                    )
+                    st.session_state.job_id = job_id
+                    st.query_params["job"] = job_id
+                    progress_bar.progress(100)
+                else:
+                    with trace("generate", mode="streaming", subject=subject):
+                        output = render_streamed_output(requirements, progress_bar)
+                    paper = parse_paper(output)
+                    progress_bar.progress(100)
+
+                    if paper.has_questions:
+                        # Render both parts from the parsed paper so the PDFs and history agree
+                        questions = paper.questions_markdown()
+                        answers = "Answer Key\n\n" + paper.answers_markdown() if paper.has_answers else None
+                        store_in_history(questions, answers, metadata, paper)
+                        st.session_state.generated_content = {
+                            'questions': questions, 'answers': answers, 'paper': paper.to_dict()
+                        }
+                        just_generated = True
+                    elif output:
+                        store_in_history(output, None, None)
+                        st.session_state.generated_content = {'questions': output, 'answers': None}
+                        just_generated = True
 
             except Exception as e:
                 st.error(f"Error generating paper: {str(e)}")
                 if 'output' in locals() and output:
                     st.markdown(output)
 
+    if st.session_state.get('job_error'):
+        st.error(f"Error generating paper: {st.session_state.pop('job_error')}")
+    if st.session_state.get('job_id'):
+        show_job_status(st.session_state.job_id)
+
+    # Keep the latest paper on screen across reruns, e.g. while a PDF is prepared
+    content = st.session_state.generated_content
+    if content:
+        if not just_generated:
+            show_generated_content(content['questions'], content['answers'])
+        generate_download_buttons(content['questions'], content['answers'], "current", paper=content.get('paper'))
+
     # Show history
     show_history()
 
@@ -0,0 +1,322 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import CancelledError, Future, TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional, Tuple
+
+import streamlit as st
+
+from dedup_index import DuplicateIndex
+from model import ANSWER_PROMPTS, MODEL_NAME, QuestionPaperGenerator, SectionFill, get_generator
+from paper_model import Paper, Question, Section, answers_from_json
+from response_cache import make_cache_key
+from single_flight import flights, prompt_key
+import tracing
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """The process-wide event loop, run forever on a daemon thread"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="generation-loop", daemon=True).start()
+        return _loop
+
+
+async def _in_trace(trace, coro):
+    # Tasks copy the loop thread's context, so carry the submitting thread's trace over
+    tracing.set_current(trace)
+    return await coro
+
+
+class AsyncQuestionPaperGenerator:
+    """asyncio variant of QuestionPaperGenerator built on generate_content_async.
+
+    Prompts, the response cache, the rate limiter and the question bank are
+    shared with the sync generator. Every session's work runs on one event
+    loop, with at most max_concurrency model calls in flight, so waiting on
+    the network no longer holds a thread per teacher.
+    """
+
+    def __init__(self, base: QuestionPaperGenerator, max_concurrency: int = 8):
+        self.base = base
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._running: Dict[str, Future] = {}
+        self._running_lock = threading.Lock()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created on first use so it belongs to the shared loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def get_model(self):
+        """The base generator's model; the first access imports and builds the client off the loop"""
+        if self.base._model is not None:
+            return self.base._model
+        return await asyncio.to_thread(lambda: self.base.model)
+
+    async def get_question_bank(self):
+        """The base generator's question bank; the first access opens, migrates and indexes it off the loop"""
+        if self.base._question_bank is not None:
+            return self.base._question_bank
+        return await asyncio.to_thread(lambda: self.base.question_bank)
+
+    async def _generate_text(self, prompt: str, cache_key: Optional[str] = None, json_mode: bool = False) -> str:
+        # The response cache is SQLite and the limiter may take a file lock: both stay off the loop
+        limiter = self.base.rate_limiter
+        if cache_key:
+            cached_response = await asyncio.to_thread(limiter.get_cached_response, cache_key)
+            if cached_response:
+                return cached_response
+
+        async def call() -> str:
+            if not await limiter.acquire_async():
+                raise RuntimeError("API rate limit reached. Please try again in a minute.")
+            model = await self.get_model()
+            async with self.semaphore:
+                with tracing.span("model.generate", json=json_mode):
+                    if json_mode:
+                        response = await model.generate_content_async(
+                            prompt, generation_config={"response_mime_type": "application/json"}
+                        )
+                    else:
+                        response = await model.generate_content_async(prompt)
+            text = response.text.strip()
+            tracing.record_usage(response, prompt, text)
+
+            if cache_key:
+                await asyncio.to_thread(limiter.cache_response, cache_key, text)
+            return text
+
+        return await flights.do_async(cache_key or prompt_key(prompt, json_mode), call)
+
+    async def _generate_with_retry(self, prompt: str, cache_key: Optional[str] = None, max_retries: int = 2) -> str:
+        for attempt in range(max_retries + 1):
+            try:
+                return await self._generate_text(prompt, cache_key)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if attempt == max_retries:
+                    raise
+                await asyncio.sleep(2 ** attempt)  # Back off before retrying
+
+    async def _answer_question(self, question: str, question_type: str, max_retries: int = 2) -> str:
+        prompt = ANSWER_PROMPTS["MCQ" if question_type == "MCQ" else "descriptive"]
+        try:
+            return await self._generate_with_retry(
+                prompt.format(question=question),
+                self.base._answer_cache_key(question, question_type),
+                max_retries
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return f"Answer unavailable: {str(e)}"
+
+    async def fill_section_questions(self, requirements: Dict, section_type: str, num_questions: int,
+                                     seen: Optional[DuplicateIndex] = None, max_rounds: int = 2) -> List[Question]:
+        """Async QuestionPaperGenerator.fill_section_questions; bank work runs off the loop"""
+        base = self.base
+        bank = await self.get_question_bank()
+        fill = SectionFill(requirements, section_type, num_questions, seen)
+        fill.add_banked(await asyncio.to_thread(
+            bank.sample, fill.subject, fill.topic, section_type, num_questions, difficulty=fill.difficulty
+        ))
+        for round_number in range(max_rounds):
+            shortfall = fill.shortfall
+            if shortfall <= 0:
+                break
+            prompt = await asyncio.to_thread(base.format_section_prompt, requirements, section_type, shortfall)
+            reply = await self._generate_text(
+                prompt,
+                cache_key=base.section_cache_key(requirements, section_type, shortfall, round_number),
+                json_mode=True
+            )
+            generated = base._parse_generated_questions(reply, section_type)
+            matches = await asyncio.to_thread(bank.find_near_duplicates, [q.text for q in generated])
+            fresh = fill.add_generated(generated, matches)
+            await asyncio.to_thread(
+                base.add_to_question_bank, fill.subject, fill.topic, section_type, fresh, fill.difficulty
+            )
+        return fill.finish()
+
+    async def answer_section(self, requirements: Dict, section_type: str, questions: List[Question]):
+        """Async QuestionPaperGenerator.answer_section"""
+        base = self.base
+        missing = [q for q in questions if not q.answer]
+        if not missing:
+            return
+
+        try:
+            prompt = await asyncio.to_thread(base.format_missing_answers_prompt, section_type, missing)
+            parts = answers_from_json(await self._generate_text(prompt, json_mode=True))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            parts = {}
+
+        # Anything the section reply did not cover is answered on its own, concurrently
+        pending = {n: question for n, question in enumerate(missing, 1) if not parts.get(n)}
+        if pending:
+            answers = await asyncio.gather(*(
+                self._answer_question(base.question_with_options(question), section_type)
+                for question in pending.values()
+            ))
+            parts.update(zip(pending, answers))
+        await asyncio.to_thread(base.save_answers, requirements, section_type, missing, parts)
+
+    async def _generate_section(self, requirements: Dict, section_type: str, num_questions: int,
+                                seen: DuplicateIndex) -> Section:
+        section = self.base.blank_section(section_type)
+        with tracing.span("section.questions", section=section_type):
+            section.questions = await self.fill_section_questions(requirements, section_type, num_questions, seen=seen)
+        if requirements.get("with_answers", True):
+            with tracing.span("section.answers", section=section_type):
+                await self.answer_section(requirements, section_type, section.questions)
+        return section
+
+    async def generate_paper(self, requirements: Dict) -> Paper:
+        """Async QuestionPaperGenerator.generate_paper; sections run as concurrent tasks"""
+        if not await self.get_model():
+            raise RuntimeError("Could not load the AI model. Please check your API key.")
+
+        cache_key = self.base.paper_cache_key(requirements)
+        cached_response = await asyncio.to_thread(self.base.rate_limiter.get_cached_response, cache_key)
+        if cached_response:
+            return Paper.from_dict(json.loads(cached_response))
+
+        async def build() -> str:
+            seen = DuplicateIndex()
+            sections = await asyncio.gather(*(
+                self._generate_section(requirements, section_type, count, seen)
+                for section_type, count in self.base.paper_sections(requirements)
+            ))
+            paper = self.base.assemble_paper(requirements, sections)
+
+            text = json.dumps(paper.to_dict())
+            await asyncio.to_thread(self.base.rate_limiter.cache_response, cache_key, text)
+            return text
+
+        return Paper.from_dict(json.loads(await flights.do_async(cache_key, build)))
+
+    async def get_output(self, requirements: Dict, parallel: bool = False) -> Tuple[str, bool]:
+        """Async QuestionPaperGenerator.get_output"""
+        if parallel:
+            try:
+                return (await self.generate_paper(requirements)).to_text(), True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return f"Error generating content: {str(e)}", False
+
+        if not await self.get_model():
+            return "Error: Could not load the AI model. Please check your API key.", False
+
+        try:
+            cache_key = make_cache_key(requirements, MODEL_NAME)
+            cached_response = await asyncio.to_thread(self.base.rate_limiter.get_cached_response, cache_key)
+            if cached_response:
+                return cached_response, True
+
+            async def build() -> Tuple[str, bool]:
+                base = self.base
+                questions = await self._generate_text(await asyncio.to_thread(base.format_question_prompt, requirements))
+                answers = await self._generate_text(await asyncio.to_thread(base.format_answer_prompt, questions))
+
+                separator = "=" * 50
+                complete_output = "Question Paper\n" + separator + "\n\n" + questions + "\n\nAnswer Key\n" + separator + "\n\n" + answers
+                await asyncio.to_thread(self.base.rate_limiter.cache_response, cache_key, complete_output)
+                return complete_output, True
+
+            return await flights.do_async(cache_key, build)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return f"Error generating content: {str(e)}", False
+
+    def submit(self, coro, session_id: Optional[str] = None) -> Future:
+        """Schedule coro on the shared loop; a session's previous job is cancelled first"""
+        future = asyncio.run_coroutine_threadsafe(_in_trace(tracing.current_trace(), coro), get_event_loop())
+        if session_id:
+            with self._running_lock:
+                previous = self._running.get(session_id)
+                self._running[session_id] = future
+            if previous is not None:
+                previous.cancel()
+            future.add_done_callback(lambda f: self._forget(session_id, f))
+        return future
+
+    def _forget(self, session_id: str, future: Future):
+        with self._running_lock:
+            if self._running.get(session_id) is future:
+                del self._running[session_id]
+
+    def cancel(self, session_id: str) -> bool:
+        """Cancel the session's running job, e.g. on reset; returns whether one was running"""
+        with self._running_lock:
+            future = self._running.pop(session_id, None)
+        return bool(future and future.cancel())
+
+    def run(self, coro, session_id: Optional[str] = None, timeout: Optional[float] = None,
+            poll: Optional[Callable[[], None]] = None, poll_interval: float = 0.25):
+        """Block the calling thread until coro finishes on the shared loop.
+
+        poll is called while waiting; in Streamlit, any st call there raises
+        when the user reruns or leaves the page, which cancels the job.
+        """
+        future = self.submit(coro, session_id)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            while True:
+                wait = poll_interval if poll else None
+                if deadline is not None:
+                    remaining = max(0.0, deadline - time.monotonic())
+                    wait = remaining if wait is None else min(wait, remaining)
+                try:
+                    return future.result(timeout=wait)
+                except FutureTimeout:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise
+                if poll:
+                    poll()
+        except BaseException:
+            future.cancel()
+            raise
+
+
+@st.cache_resource(show_spinner=False)
+def get_async_generator() -> AsyncQuestionPaperGenerator:
+    """Shared across sessions so cancel() can reach any session's running job"""
+    return AsyncQuestionPaperGenerator(get_generator())
+
+
+def get_output(requirements: Dict, parallel: bool = False, session_id: Optional[str] = None,
+               poll: Optional[Callable[[], None]] = None) -> str:
+    """Sync facade matching model.get_output, served from the shared event loop"""
+    try:
+        async_generator = get_async_generator()
+        output, success = async_generator.run(
+            async_generator.get_output(requirements, parallel=parallel), session_id, poll=poll
+        )
+    except CancelledError:
+        return "Error: Generation was cancelled."
+    return output
+
+
+def generate_paper(requirements: Dict, session_id: Optional[str] = None,
+                   poll: Optional[Callable[[], None]] = None) -> Paper:
+    async_generator = get_async_generator()
+    return async_generator.run(async_generator.generate_paper(requirements), session_id, poll=poll)
+
+
+def cancel(session_id: str) -> bool:
+    return get_async_generator().cancel(session_id)
@@ -0,0 +1,274 @@
+"""Generate many question papers without the Streamlit UI.
+
+    python batch_generate.py jobs.jsonl --out batch_output --concurrency 4
+
+Each JSONL line or CSV row describes one paper: subject, topic, syllabus
+(or syllabus_file), num_mcq, num_3_marks, num_5_marks, difficulty and
+with_answers, or a template name from templates.json that fills in the
+counts and difficulty. An optional name is used for the output files.
+Finished jobs are recorded in a checkpoint file, so rerunning the same
+command after an interruption picks up where it stopped.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from history_manager import HistoryManager
+from model import MODEL_NAME, get_generator
+from pdf_export import convert_to_pdf
+from pdf_text import extract_text
+from response_cache import make_cache_key
+from templates import load_templates
+from tracing import trace
+
+INT_FIELDS = ("num_mcq", "num_3_marks", "num_5_marks")
+
+
+def read_jobs(path: str) -> List[Dict]:
+    """Read job rows from a .jsonl or .csv file"""
+    with open(path, "r", newline="") as f:
+        if path.lower().endswith(".csv"):
+            return [dict(row) for row in csv.DictReader(f)]
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() not in ("", "0", "false", "no", "n")
+    return bool(value)
+
+
+def _read_syllabus(path: str) -> str:
+    if path.lower().endswith(".pdf"):
+        with open(path, "rb") as f:
+            return extract_text(f.read())[0]
+    with open(path, "r") as f:
+        return f.read()
+
+
+def build_requirements(row: Dict, templates: Dict) -> Dict:
+    """Turn one job row into the requirements dict the generator expects"""
+    settings = {}
+    if row.get("template"):
+        if row["template"] not in templates:
+            raise ValueError(f"Unknown template: {row['template']}")
+        template = templates[row["template"]]
+        settings = {
+            "num_mcq": template["num_mcq"],
+            "num_3_marks": template["num_3_marks"],
+            "num_5_marks": template["num_5_marks"],
+            "difficulty": template["selected_option"],
+            "with_answers": template.get("include_answers", True)
+        }
+    # Explicit values in the row override the template
+    settings.update({k: v for k, v in row.items() if v not in (None, "") and k != "template"})
+
+    syllabus = settings.get("syllabus") or ""
+    if not syllabus and settings.get("syllabus_file"):
+        syllabus = _read_syllabus(settings["syllabus_file"])
+    if not syllabus:
+        syllabus = f"Subject: {settings.get('subject', '')}\nAll topics covered"
+
+    requirements = {
+        "syllabus": syllabus,
+        "subject": settings.get("subject", ""),
+        "topic": settings.get("topic", ""),
+        "difficulty": settings.get("difficulty", "Medium"),
+        "with_answers": _as_bool(settings.get("with_answers", True))
+    }
+    for field in INT_FIELDS:
+        requirements[field] = int(settings.get(field) or 0)
+    if not any(requirements[field] for field in INT_FIELDS):
+        raise ValueError("Job asks for no questions")
+    return requirements
+
+
+def job_name(row: Dict, requirements: Dict, key: str) -> str:
+    name = row.get("name") or "_".join(
+        part for part in (requirements["subject"], requirements["topic"], requirements["difficulty"]) if part
+    )
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "paper"
+    return f"{name}_{key[:8]}"
+
+
+class Checkpoint:
+    """Append-only JSONL record of finished jobs; the last entry per job wins"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by an interruption
+                        continue
+                    self.entries[entry["job"]] = entry
+
+    def done(self, job: str) -> bool:
+        return self.entries.get(job, {}).get("status") == "done"
+
+    def record(self, job: str, **fields):
+        entry = dict(job=job, **fields)
+        with self._lock:
+            self.entries[job] = entry
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def run_job(name: str, requirements: Dict, out_dir: str, history: HistoryManager) -> Dict:
+    """Generate one paper, write its PDFs and add it to history"""
+    started = time.perf_counter()
+    with trace("batch_job", job=name):
+        paper = get_generator().generate_paper(requirements)
+    questions = paper.questions_markdown()
+    answers = "Answer Key\n\n" + paper.answers_markdown() if paper.has_answers else None
+
+    files = [os.path.join(out_dir, f"{name}_questions.pdf")]
+    with open(files[0], "wb") as f:
+        f.write(convert_to_pdf(paper.questions_only()).getvalue())
+    if answers:
+        files.append(os.path.join(out_dir, f"{name}_answers.pdf"))
+        with open(files[1], "wb") as f:
+            f.write(convert_to_pdf(paper.answers_only()).getvalue())
+
+    metadata = {
+        'subject': requirements['subject'],
+        'topic': requirements['topic'],
+        'difficulty': requirements['difficulty'],
+        'total_marks': paper.total_marks,
+        'num_mcq': requirements['num_mcq'],
+        'num_3_marks': requirements['num_3_marks'],
+        'num_5_marks': requirements['num_5_marks']
+    }
+    paper_id = history.add_paper(questions, answers, metadata, paper=paper.to_dict())
+    return {
+        'paper_id': paper_id,
+        'files': files,
+        'questions': sum(len(s.questions) for s in paper.sections),
+        'seconds': time.perf_counter() - started
+    }
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def print_summary(results: Dict[str, Dict], skipped: int, coalesced: int, failed: int, elapsed: float,
+                  interrupted: bool):
+    durations = [r['seconds'] for r in results.values()]
+    questions = sum(r['questions'] for r in results.values())
+    cache = get_generator().rate_limiter.cache.stats()
+    print()
+    print("Batch interrupted; rerun the same command to resume" if interrupted else "Batch finished")
+    print(f"  papers generated : {len(results)}")
+    print(f"  already done     : {skipped}")
+    print(f"  duplicate jobs   : {coalesced}")
+    print(f"  failed           : {failed}")
+    print(f"  wall time        : {elapsed:.1f}s")
+    if elapsed > 0 and results:
+        print(f"  throughput       : {len(results) / elapsed * 60:.1f} papers/min, "
+              f"{questions / elapsed * 60:.1f} questions/min")
+    if durations:
+        print(f"  latency          : p50 {percentile(durations, 0.5):.1f}s, "
+              f"p95 {percentile(durations, 0.95):.1f}s, max {max(durations):.1f}s")
+    print(f"  response cache   : {cache['hits']} hits, {cache['misses']} misses")
+
+
+def plan_jobs(rows: List[Dict], templates: Dict) -> Tuple[List[Tuple[str, Dict]], int, int]:
+    """Resolve rows into (name, requirements), dropping invalid rows and exact repeats"""
+    jobs, keys, invalid, coalesced = [], set(), 0, 0
+    for line, row in enumerate(rows, 1):
+        try:
+            requirements = build_requirements(row, templates)
+        except (ValueError, OSError) as e:
+            print(f"Skipping job {line}: {e}", file=sys.stderr)
+            invalid += 1
+            continue
+        key = make_cache_key(requirements, MODEL_NAME, namespace="batch")
+        name = job_name(row, requirements, key)
+        if (name, key) in keys:
+            # Identical requirements produce the identical (cached) paper
+            coalesced += 1
+            continue
+        keys.add((name, key))
+        jobs.append((name, requirements))
+    return jobs, invalid, coalesced
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate question papers in bulk")
+    parser.add_argument("jobs", help="JSONL or CSV file with one paper per line/row")
+    parser.add_argument("--out", default="batch_output", help="directory for PDFs and the checkpoint")
+    parser.add_argument("--concurrency", type=int, default=4, help="papers generated at once")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <out>/checkpoint.jsonl)")
+    parser.add_argument("--history-file", default="paper_history.json", help="history to add papers to")
+    args = parser.parse_args(argv)
+
+    if not get_generator().model:
+        print("Could not load the AI model. Please check your API key.", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.out, exist_ok=True)
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(args.out, "checkpoint.jsonl"))
+    jobs, failed, coalesced = plan_jobs(read_jobs(args.jobs), load_templates())
+    pending = [(name, requirements) for name, requirements in jobs if not checkpoint.done(name)]
+    skipped = len(jobs) - len(pending)
+    history = HistoryManager(args.history_file)
+
+    print(f"{len(pending)} papers to generate ({skipped} already done), concurrency {args.concurrency}")
+    results = {}
+    interrupted = False
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=max(1, args.concurrency))
+    def work(name: str, requirements: Dict) -> Dict:
+        # Checkpoint from the worker so jobs that finish after Ctrl+C still count
+        try:
+            result = run_job(name, requirements, args.out, history)
+        except Exception as e:
+            checkpoint.record(name, status="failed", error=str(e))
+            raise
+        checkpoint.record(name, status="done", **result)
+        return result
+
+    try:
+        futures = {executor.submit(work, name, requirements): name for name, requirements in pending}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[{len(results) + failed}/{len(pending)}] {name}: failed: {e}", file=sys.stderr)
+                continue
+            results[name] = result
+            print(f"[{len(results) + failed}/{len(pending)}] {name}: {result['questions']} questions "
+                  f"in {result['seconds']:.1f}s")
+    except KeyboardInterrupt:
+        # Jobs already running finish and are checkpointed; queued ones wait for the next run
+        interrupted = True
+        executor.shutdown(wait=False, cancel_futures=True)
+    finally:
+        executor.shutdown(wait=True)
+
+    print_summary(results, skipped, coalesced, failed, time.perf_counter() - started, interrupted)
+    if interrupted:
+        return 130
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Cold-start import budget for the app.
+
+    python benchmarks/import_time.py                  # fail if over budget
+    python benchmarks/import_time.py --runs 5 --detail
+
+Each run imports app.py in a fresh interpreter, the way a new container
+does on its first page view, and reports the median wall time. It also
+checks that the heavy optional libraries stay out of startup: ReportLab,
+PyPDF2, pandas, plotly and the Gemini SDK should load on first use only.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules the first page view needs
+COMMON_PATH = ["app"]
+# Libraries that must not load until something uses them
+LAZY = ["reportlab", "PyPDF2", "pandas", "plotly", "google.generativeai"]
+DEFAULT_BUDGET = float(os.environ.get("PAPER_IMPORT_BUDGET", "2.5"))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+
+def run_probe(modules: List[str], detail: bool = False) -> Dict:
+    """Import modules in a fresh interpreter started in a scratch directory"""
+    env = dict(os.environ, PYTHONPATH=ROOT, PAPER_MODEL_BACKEND="fake", PAPER_METRICS_FILE=os.devnull)
+    command = [sys.executable]
+    if detail:
+        command += ["-X", "importtime"]
+    command += ["-c", PROBE.format(modules=modules, lazy=LAZY)]
+    with tempfile.TemporaryDirectory(prefix="paper-import-") as workdir:
+        result = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "import failed")
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    if detail:
+        probe['importtime'] = result.stderr
+    return probe
+
+
+def slowest_imports(importtime: str, top: int = 15) -> List[str]:
+    """Top-level packages by cumulative import time, from -X importtime output"""
+    rows = []
+    for line in importtime.splitlines():
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        name = parts[2]
+        if name == name.lstrip():
+            rows.append((int(parts[1]), name))
+    rows.sort(reverse=True)
+    return [f"{us / 1e6:8.3f}s  {name}" for us, name in rows[:top]]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the app's cold-start import time")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to time")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="median seconds allowed")
+    parser.add_argument("--detail", action="store_true", help="list the slowest top-level imports")
+    args = parser.parse_args(argv)
+
+    probes = [run_probe(COMMON_PATH) for _ in range(args.runs)]
+    median = statistics.median(p['seconds'] for p in probes)
+    loaded = sorted({m for p in probes for m in p['loaded']})
+    print(f"import {', '.join(COMMON_PATH)}: median {median:.3f}s over {args.runs} runs (budget {args.budget:.2f}s)")
+    if args.detail:
+        print("\n".join(slowest_imports(run_probe(COMMON_PATH, detail=True)['importtime'])))
+
+    failed = False
+    if median > args.budget:
+        print(f"OVER BUDGET by {median - args.budget:.3f}s")
+        failed = True
+    if loaded:
+        print(f"Loaded at startup but should be lazy: {', '.join(loaded)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
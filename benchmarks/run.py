@@ -0,0 +1,302 @@
+"""Offline performance benchmarks on the fake model backend.
+
+    python benchmarks/run.py                      # run everything, compare to baseline.json
+    python benchmarks/run.py --only history --sizes 10000
+    python benchmarks/run.py --save-baseline      # record the current numbers as the baseline
+
+Generation replays recorded papers from paper_history.json through
+model_backend.FakeGenerativeModel with a configurable latency and error rate.
+Nothing touches the network or the app's own databases: every run works in
+a fresh temporary directory. A benchmark is flagged as a regression when its
+p95 latency or throughput is more than --tolerance worse than the baseline.
+Baselines are machine specific; record one on the machine that compares.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HISTORY_FILE = os.path.join(ROOT, "paper_history.json")
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+SUBJECTS = ["Data Structures and Algorithms", "Operating Systems", "Database Management System",
+            "Computer Networks", "Theory of Computation"]
+TOPICS = ["Trees", "Scheduling", "Normalization", "Routing", "Automata", "Hashing", "Paging", "Indexing"]
+SEARCH_TERMS = ["stack", "deadlock", "normal form", "binary tree", "semaphore", "routing"]
+
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def benchmark(name: str):
+    def register(fn: Callable) -> Callable:
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def measure(fn: Callable[[int], None], iterations: int, workers: int = 1) -> Dict:
+    """Call fn(i) for each iteration, optionally from several threads, and summarise the latencies"""
+    latencies = []
+
+    def timed(i: int):
+        start = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(timed, range(iterations)))
+    else:
+        for i in range(iterations):
+            timed(i)
+    elapsed = time.perf_counter() - started
+    return {
+        'ops': iterations,
+        'throughput': round(iterations / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3) if latencies else 0.0
+    }
+
+
+def recorded_papers() -> List[Dict]:
+    with open(HISTORY_FILE, 'r') as f:
+        history = json.load(f)
+    # Failed generations were recorded as "Error ..." text, which is not a paper
+    return [p for p in (history if isinstance(history, list) else history.values())
+            if p.get('questions') and not p['questions'].startswith("Error")]
+
+
+def requirements_for(i: int, syllabus: str = "") -> Dict:
+    # A distinct topic per iteration keeps the response cache from answering
+    return {
+        "syllabus": syllabus or f"Subject: {SUBJECTS[i % len(SUBJECTS)]}\nAll topics covered",
+        "subject": SUBJECTS[i % len(SUBJECTS)],
+        "topic": f"{TOPICS[i % len(TOPICS)]} {i}",
+        "num_mcq": 10,
+        "num_3_marks": 12,
+        "num_5_marks": 10,
+        "difficulty": "Medium",
+        "with_answers": True
+    }
+
+
+def make_generator(args):
+    from model import APIRateLimiter, QuestionPaperGenerator
+    from model_backend import FakeGenerativeModel
+    from response_cache import ResponseCache
+
+    fake = FakeGenerativeModel(HISTORY_FILE, latency=args.latency, jitter=args.latency / 4,
+                               error_rate=args.error_rate, seed=args.seed)
+    generator = QuestionPaperGenerator(model=fake)
+    # The real per-minute budget would measure the limiter, not the app
+    generator.rate_limiter = APIRateLimiter(calls_per_minute=10 ** 6, cache=ResponseCache("bench_cache.db"),
+                                            shared_path=None)
+    return generator
+
+
+@benchmark("generation.standard")
+def bench_generation_standard(args) -> Dict:
+    generator = make_generator(args)
+    return measure(lambda i: generator.get_output(requirements_for(i)), args.iterations)
+
+
+@benchmark("generation.parallel")
+def bench_generation_parallel(args) -> Dict:
+    generator = make_generator(args)
+    return measure(lambda i: generator.generate_paper(requirements_for(i)), args.iterations)
+
+
+@benchmark("generation.concurrent")
+def bench_generation_concurrent(args) -> Dict:
+    generator = make_generator(args)
+    return measure(lambda i: generator.generate_paper(requirements_for(i + 10_000)),
+                   args.iterations * args.concurrency, workers=args.concurrency)
+
+
+@benchmark("pdf.build")
+def bench_pdf_build(args) -> Dict:
+    from pdf_export import convert_to_pdf
+    from paper_model import parse_paper
+
+    papers = recorded_papers()
+    texts = [p['questions'] for p in papers] + [p['answers'] for p in papers if p.get('answers')]
+    # The app hands convert_to_pdf a parsed Paper, so parsing stays out of the timing
+    parsed = [parse_paper(text) for text in texts]
+    # The first build pays for ReportLab's imports and font setup; keep it out of the percentiles
+    convert_to_pdf(parsed[0])
+    return measure(lambda i: convert_to_pdf(parsed[i % len(parsed)]), max(args.iterations, len(parsed)))
+
+
+def synthetic_paper(i: int, papers: List[Dict], start: datetime):
+    paper = papers[i % len(papers)]
+    timestamp = (start + timedelta(minutes=7 * i)).strftime("%Y-%m-%d %H:%M:%S")
+    metadata = {
+        'subject': SUBJECTS[i % len(SUBJECTS)],
+        'topic': TOPICS[i % len(TOPICS)],
+        'difficulty': ["Easy", "Medium", "Hard"][i % 3],
+        'total_marks': 100,
+        'num_mcq': 10,
+        'num_3_marks': 12,
+        'num_5_marks': 10
+    }
+    return timestamp, paper['questions'], paper.get('answers'), metadata
+
+
+def bench_history(args, size: int) -> Dict[str, Dict]:
+    from history_store import HistoryStore
+
+    papers = recorded_papers()
+    store = HistoryStore(f"history_{size}.db")
+    start = datetime(2024, 1, 1)
+    results = {}
+    results[f"history.add@{size}"] = measure(
+        lambda i: store.add(*synthetic_paper(i, papers, start)), size
+    )
+    rng = random.Random(args.seed)
+    n = args.iterations * 20
+    results[f"history.get@{size}"] = measure(lambda i: store.get(rng.randint(1, size)), n)
+    results[f"history.page@{size}"] = measure(lambda i: store.list(offset=(i * 20) % size, limit=20), n)
+    results[f"history.filter@{size}"] = measure(
+        lambda i: store.list(limit=20, since=start + timedelta(minutes=7 * ((i * 97) % size)),
+                             query=SUBJECTS[i % len(SUBJECTS)]), n
+    )
+    results[f"history.recent@{size}"] = measure(lambda i: store.recent(20), n)
+    results[f"history.statistics@{size}"] = measure(lambda i: store.statistics(), n)
+    results[f"search@{size}"] = measure(lambda i: store.search(SEARCH_TERMS[i % len(SEARCH_TERMS)], limit=20), n)
+    results[f"history.delete@{size}"] = measure(lambda i: store.delete(size - i), min(n, size))
+    return results
+
+
+def bench_bank(args, size: int) -> Dict[str, Dict]:
+    from question_bank import QuestionBank
+
+    papers = recorded_papers()
+    rng = random.Random(args.seed)
+    pool = [q for p in papers for q in p['questions'].splitlines() if len(q.split()) > 5]
+    bank = QuestionBank(f"bank_{size}.db")
+    # Shuffled recorded questions with a unique tail so they are not all near-duplicates
+    rows = [
+        (SUBJECTS[i % len(SUBJECTS)], TOPICS[i % len(TOPICS)], ["MCQ", "descriptive_3", "descriptive_5"][i % 3],
+         "Medium", " ".join(rng.sample(pool[i % len(pool)].split(), k=len(pool[i % len(pool)].split())))
+         + f" (case {i})")
+        for i in range(size)
+    ]
+    results = {f"bank.add@{size}": measure(lambda i: bank.add_many(rows[i * 1000:(i + 1) * 1000]),
+                                           -(-size // 1000))}
+    n = args.iterations * 20
+    results[f"bank.sample@{size}"] = measure(
+        lambda i: bank.sample(SUBJECTS[i % len(SUBJECTS)], TOPICS[i % len(TOPICS)], "MCQ", 10, difficulty="Medium"), n
+    )
+    reopened = QuestionBank(f"bank_{size}.db")
+    results[f"bank.load_index@{size}"] = measure(lambda i: len(reopened.duplicates), 1)
+    results[f"bank.dedup30@{size}"] = measure(
+        lambda i: reopened.find_near_duplicates([rows[(i * 30 + j) % size][4] for j in range(30)]), args.iterations
+    )
+    return results
+
+
+def run(args) -> Dict[str, Dict]:
+    results = {}
+    selected = [name for name in BENCHMARKS if not args.only or any(name.startswith(o) for o in args.only)]
+    for name in selected:
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = BENCHMARKS[name](args)
+    for size in args.sizes:
+        if not args.only or any(o.startswith(("history", "search")) for o in args.only):
+            print(f"running history/search @ {size}...", file=sys.stderr)
+            results.update(bench_history(args, size))
+        if not args.only or any(o.startswith("bank") for o in args.only):
+            print(f"running question bank @ {size}...", file=sys.stderr)
+            results.update(bench_bank(args, size))
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Print a results table; return the names of benchmarks that regressed"""
+    regressions = []
+    print(f"{'benchmark':32} {'ops':>7} {'ops/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}  vs baseline")
+    for name, r in results.items():
+        note = ""
+        base = baseline.get(name)
+        if base:
+            slower = base['p95_ms'] and r['p95_ms'] > base['p95_ms'] * (1 + tolerance)
+            fewer = base['throughput'] and r['throughput'] < base['throughput'] / (1 + tolerance)
+            change = (r['p95_ms'] / base['p95_ms'] - 1) * 100 if base['p95_ms'] else 0.0
+            note = f"p95 {change:+.0f}%"
+            if slower or fewer:
+                note += "  REGRESSION"
+                regressions.append(name)
+        print(f"{name:32} {r['ops']:>7} {r['throughput']:>10.1f} {r['p50_ms']:>10.2f} {r['p95_ms']:>10.2f} "
+              f"{r['p99_ms']:>10.2f}  {note}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks on the fake model backend")
+    parser.add_argument("--only", nargs="*", help="benchmark name prefixes, e.g. generation pdf history bank search")
+    parser.add_argument("--sizes", type=lambda v: [int(s) for s in v.split(",")], default=[10_000, 100_000],
+                        help="history and question bank sizes (default: 10000,100000)")
+    parser.add_argument("--iterations", type=int, default=10, help="iterations per benchmark")
+    parser.add_argument("--concurrency", type=int, default=4, help="threads for generation.concurrent")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency per call, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake model calls that fail")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before flagging")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    # Everything below runs on the fake backend inside a scratch directory
+    os.environ["PAPER_MODEL_BACKEND"] = "fake"
+    os.environ.setdefault("PAPER_METRICS_FILE", os.devnull)
+    workdir = tempfile.mkdtemp(prefix="paper-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results = run(args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
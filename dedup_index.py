@@ -0,0 +1,133 @@
+import re
+import threading
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+BANDS = 16
+# Estimated Jaccard similarity above which two questions count as the same
+THRESHOLD = 0.7
+
+# Smallest prime above 2**32; with 32-bit inputs and coefficients a*x + b fits in uint64
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+def normalize(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def shingles(text: str, k: int = SHINGLE_SIZE) -> np.ndarray:
+    """32-bit hashes of the distinct k-word shingles of text"""
+    words = normalize(text)
+    if len(words) < k:
+        grams = {" ".join(words)} if words else set()
+    else:
+        grams = {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+class MinHasher:
+    """MinHash signatures from num_perm universal hash functions, one vectorized pass per text"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingles(text)
+        if not len(hashes):
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+        permuted = (hashes[:, None] * self.a + self.b) % _PRIME
+        return np.minimum(permuted.min(axis=0), _MAX_HASH).astype(np.uint32)
+
+    def signatures(self, texts: Iterable[str]) -> np.ndarray:
+        rows = [self.signature(text) for text in texts]
+        return np.vstack(rows) if rows else np.empty((0, self.num_perm), dtype=np.uint32)
+
+
+class DuplicateIndex:
+    """In-memory MinHash LSH index of question signatures.
+
+    Signatures are split into bands; two questions become candidates when any
+    band hashes the same, and candidates are confirmed by their estimated
+    Jaccard similarity. Band hashes live in one NumPy array, so a lookup is a
+    single vectorized comparison and adds are amortized O(1) appends.
+    """
+
+    def __init__(self, threshold: float = THRESHOLD, num_perm: int = NUM_PERM, bands: int = BANDS,
+                 hasher: Optional[MinHasher] = None):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = hasher or MinHasher(num_perm)
+        self._band_mix = np.random.default_rng(2).integers(1, 1 << 63, self.rows, dtype=np.uint64) | np.uint64(1)
+        self._keys = np.empty(0, dtype=np.int64)
+        self._signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._band_hashes = np.empty((0, bands), dtype=np.uint64)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def signature(self, text: str) -> np.ndarray:
+        return self.hasher.signature(text)
+
+    def _hash_bands(self, signatures: np.ndarray) -> np.ndarray:
+        # uint64 arithmetic wraps, which is all a band hash needs
+        split = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        return (split * self._band_mix).sum(axis=2, dtype=np.uint64)
+
+    def _grow(self, needed: int):
+        capacity = len(self._keys)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        for name in ("_keys", "_signatures", "_band_hashes"):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add_signatures(self, keys: Iterable[int], signatures: np.ndarray):
+        keys = np.fromiter(keys, dtype=np.int64)
+        if not len(keys):
+            return
+        band_hashes = self._hash_bands(signatures)
+        with self._lock:
+            self._grow(self._size + len(keys))
+            end = self._size + len(keys)
+            self._keys[self._size:end] = keys
+            self._signatures[self._size:end] = signatures
+            self._band_hashes[self._size:end] = band_hashes
+            self._size = end
+
+    def add(self, key: int, text: str):
+        self.add_signatures([key], self.signature(text)[None, :])
+
+    def matches(self, signature: np.ndarray, threshold: Optional[float] = None) -> List[Tuple[int, float]]:
+        """(key, similarity) of indexed questions at or above threshold, most similar first"""
+        threshold = self.threshold if threshold is None else threshold
+        band_hashes = self._hash_bands(signature[None, :])[0]
+        with self._lock:
+            size = self._size
+            candidates = np.flatnonzero((self._band_hashes[:size] == band_hashes).any(axis=1))
+            if not len(candidates):
+                return []
+            similarity = (self._signatures[candidates] == signature).mean(axis=1)
+            keys = self._keys[candidates]
+        order = np.argsort(-similarity, kind="stable")
+        return [(int(keys[i]), float(similarity[i])) for i in order if similarity[i] >= threshold]
+
+    def find(self, text: str) -> Optional[int]:
+        """Key of the closest near-duplicate of text, or None"""
+        found = self.matches(self.signature(text))
+        return found[0][0] if found else None
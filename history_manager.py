@@ -1,96 +1,93 @@
-import json
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from typing import Dict, List, Optional
 import os
+from history_store import HistoryStore
+from storage import FileLock, atomic_write_json
+import tracing
 
 class HistoryManager:
     def __init__(self, history_file: str = "paper_history.json"):
         self.history_file = history_file
-        self.history = self.load_history()
+        # Papers live in an append-only SQLite store next to the legacy JSON file
+        self.store = HistoryStore(os.path.splitext(history_file)[0] + ".db", legacy_file=history_file)
+        self._export_lock = FileLock(history_file + ".lock")
+        self._history = None
+
+    @property
+    def history(self) -> List[Dict]:
+        """All papers, loaded lazily from the store"""
+        if self._history is None:
+            self._history = self.load_history()
+        return self._history
         
     def load_history(self) -> List[Dict]:
-        """Load history from file"""
+        """Load history from the store"""
         try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, 'r') as f:
-                    return json.load(f)
-            return []
+            return self.store.all()
         except Exception as e:
             print(f"Error loading history: {e}")
             return []
     
     def save_history(self):
-        """Save history to file"""
+        """Export history to the legacy JSON file"""
         try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.history, f, indent=4)
+            # Locked so two app processes exporting at once cannot interleave, atomic so a crash
+            # mid-write leaves the previous file intact
+            with tracing.span("history.export"), self._export_lock:
+                atomic_write_json(self.history_file, self.store.all())
         except Exception as e:
             print(f"Error saving history: {e}")
     
-    def add_paper(self, questions: str, answers: Optional[str], metadata: Dict):
+    def add_paper(self, questions: str, answers: Optional[str], metadata: Dict, paper: Optional[Dict] = None):
         """Add a new paper to history"""
-        paper = {
-            'id': len(self.history) + 1,
-            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'questions': questions,
-            'answers': answers,
-            'metadata': metadata
-        }
-        self.history.append(paper)
-        self.save_history()
-        return paper['id']
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with tracing.span("history.save"):
+            paper_id = self.store.add(timestamp, questions, answers, metadata, paper=paper)
+        self._history = None
+        return paper_id
     
     def get_paper(self, paper_id: int) -> Optional[Dict]:
         """Get a specific paper by ID"""
-        for paper in self.history:
-            if paper['id'] == paper_id:
-                return paper
-        return None
+        return self.store.get(paper_id)
     
     def get_all_papers(self, limit: Optional[int] = None) -> List[Dict]:
         """Get all papers, optionally limited to a number"""
-        papers = sorted(self.history, key=lambda x: x['timestamp'], reverse=True)
-        return papers[:limit] if limit else papers
+        return self.store.recent(limit)
+    
+    def get_papers(self, offset: int = 0, limit: int = 20, since=None, until=None,
+                   query: Optional[str] = None) -> Dict:
+        """Get one page of paper summaries, newest first, filtered by date range and search query"""
+        return self.store.list(offset=offset, limit=limit, since=since, until=until, query=query)
     
     def delete_paper(self, paper_id: int) -> bool:
         """Delete a paper from history"""
-        for i, paper in enumerate(self.history):
-            if paper['id'] == paper_id:
-                self.history.pop(i)
-                self.save_history()
-                return True
-        return False
+        deleted = self.store.delete(paper_id)
+        if deleted:
+            self._history = None
+        return deleted
     
-    def search_papers(self, query: str) -> List[Dict]:
-        """Search papers by subject or topic"""
-        query = query.lower()
-        return [
-            paper for paper in self.history
-            if query in paper['metadata'].get('subject', '').lower() or
-               query in paper['metadata'].get('topic', '').lower()
-        ]
+    def search_papers(self, query: str, limit: int = 100) -> List[Dict]:
+        """Search papers by metadata, question and answer text, best matches first"""
+        hits = self.store.search(query, limit=limit)['hits']
+        papers = (self.store.get(hit['id']) for hit in hits)
+        return [paper for paper in papers if paper]
+    
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> Dict:
+        """Paginated search returning ranked hits with highlighted snippets"""
+        return self.store.search(query, offset=offset, limit=limit)
     
     def get_statistics(self) -> Dict:
         """Get statistics about generated papers"""
-        return {
-            'total_papers': len(self.history),
-            'papers_by_subject': self._count_by_field('subject'),
-            'papers_by_difficulty': self._count_by_field('difficulty'),
-            'average_marks': self._calculate_average_marks()
-        }
-    
-    def _count_by_field(self, field: str) -> Dict:
-        """Helper to count papers by a metadata field"""
-        counts = {}
-        for paper in self.history:
-            value = paper['metadata'].get(field, 'Unknown')
-            counts[value] = counts.get(value, 0) + 1
-        return counts
+        return self.store.statistics()
     
-    def _calculate_average_marks(self) -> float:
-        """Calculate average total marks across all papers"""
-        total = sum(
-            paper['metadata'].get('total_marks', 0) 
-            for paper in self.history
-        )
-        return total / len(self.history) if self.history else 0 
\ No newline at end of file
+    def get_papers_over_time(self, period: str = "day", since: Optional[date] = None) -> List[Dict]:
+        """Paper counts per day or per week (weeks start on Monday)"""
+        daily = self.store.papers_per_day(since)
+        if period == "day":
+            return daily
+        weekly = {}
+        for entry in daily:
+            day = datetime.strptime(entry['date'], "%Y-%m-%d").date()
+            week_start = (day - timedelta(days=day.weekday())).strftime("%Y-%m-%d")
+            weekly[week_start] = weekly.get(week_start, 0) + entry['count']
+        return [{'date': week, 'count': count} for week, count in weekly.items()]
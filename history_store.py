@@ -0,0 +1,488 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Union
+
+from storage import connect
+
+
+class HistoryStore:
+    """Append-only SQLite store for generated papers.
+
+    Adds are single-row inserts, deletes only mark a tombstone, and tombstoned
+    rows are purged in bulk once enough of them have piled up.
+    """
+
+    def __init__(self, db_file: str, legacy_file: Optional[str] = None, compact_threshold: int = 100):
+        self.db_file = db_file
+        self.compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._conn = connect(db_file)
+        # list() totals by filter, with the (max id, live papers) version they were counted at
+        self._totals: Dict[Tuple, Tuple] = {}
+        if self._conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Changing the vacuum mode needs a one-off VACUUM, which is free on a new file
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("VACUUM")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS papers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                questions TEXT,
+                answers TEXT,
+                metadata TEXT,
+                deleted INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        if "paper_json" not in {row[1] for row in self._conn.execute("PRAGMA table_info(papers)")}:
+            # Structured Paper.to_dict() form, for histories created before papers were parsed
+            self._conn.execute("ALTER TABLE papers ADD COLUMN paper_json TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_papers_tombstones ON papers(id) WHERE deleted = 1"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_papers_timestamp ON papers(deleted, timestamp)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS stats_counts (
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (field, value)
+            )
+        """)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stats_daily (day TEXT PRIMARY KEY, count INTEGER NOT NULL)"
+        )
+        self.fts_enabled = self._create_search_index()
+        if legacy_file:
+            self._migrate(legacy_file)
+        if self.fts_enabled:
+            self._backfill_search_index()
+        self._backfill_statistics()
+
+    def _create_search_index(self) -> bool:
+        """Create the full-text index; returns False when SQLite lacks FTS5"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT sql FROM sqlite_master WHERE name = 'papers_fts'").fetchone()
+                if row and "prefix" not in row[0]:
+                    # Built before the prefix indexes existed: recreate it and let the backfill refill it
+                    self._conn.execute("DROP TABLE papers_fts")
+                    self._conn.execute("DELETE FROM meta WHERE key = 'fts_indexed'")
+                # Search terms are matched as prefixes; short ones are served by these indexes
+                self._conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(
+                        subject, topic, difficulty, questions, answers,
+                        tokenize = 'porter unicode61 remove_diacritics 2',
+                        prefix = '2 3'
+                    )
+                """)
+                self._conn.execute("COMMIT")
+                return True
+            except sqlite3.OperationalError:
+                self._conn.execute("ROLLBACK")
+                return False
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _backfill_search_index(self):
+        """Index papers written before the search index existed"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._get_meta("fts_indexed") is None:
+                    self._conn.execute("""
+                        INSERT INTO papers_fts (rowid, subject, topic, difficulty, questions, answers)
+                        SELECT id, json_extract(metadata, '$.subject'), json_extract(metadata, '$.topic'),
+                               json_extract(metadata, '$.difficulty'), questions, answers
+                        FROM papers
+                        WHERE deleted = 0 AND id NOT IN (SELECT rowid FROM papers_fts)
+                    """)
+                    self._set_meta("fts_indexed", "1")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _backfill_statistics(self):
+        """Build the running aggregates once for papers stored before they existed"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._get_meta("stats_built") is None:
+                    self._conn.execute("DELETE FROM stats_counts")
+                    self._conn.execute("DELETE FROM stats_daily")
+                    self._set_meta("stats_papers", "0")
+                    self._set_meta("stats_marks_sum", "0")
+                    for row in self._conn.execute(
+                        "SELECT timestamp, metadata FROM papers WHERE deleted = 0"
+                    ).fetchall():
+                        metadata = json.loads(row['metadata']) if row['metadata'] else {}
+                        self._update_statistics(row['timestamp'], metadata, 1)
+                    self._set_meta("stats_built", "1")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _update_statistics(self, timestamp: str, metadata: Dict, delta: int):
+        """Apply one paper (+1) or its removal (-1) to the running aggregates"""
+        for field in ('subject', 'difficulty'):
+            self._conn.execute(
+                "INSERT INTO stats_counts (field, value, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (field, value) DO UPDATE SET count = count + excluded.count",
+                (field, str(metadata.get(field, 'Unknown')), delta)
+            )
+        self._conn.execute(
+            "INSERT INTO stats_daily (day, count) VALUES (?, ?) "
+            "ON CONFLICT (day) DO UPDATE SET count = count + excluded.count",
+            (timestamp[:10], delta)
+        )
+        self._conn.execute(
+            "UPDATE meta SET value = CAST(value AS INTEGER) + ? WHERE key = 'stats_papers'", (delta,)
+        )
+        self._conn.execute(
+            "UPDATE meta SET value = CAST(value AS REAL) + ? WHERE key = 'stats_marks_sum'",
+            (delta * (metadata.get('total_marks') or 0),)
+        )
+
+    def _index_paper(self, paper_id: int, questions: Optional[str], answers: Optional[str], metadata: Dict):
+        if self.fts_enabled:
+            self._conn.execute(
+                "INSERT INTO papers_fts (rowid, subject, topic, difficulty, questions, answers) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (paper_id, metadata.get('subject'), metadata.get('topic'),
+                 metadata.get('difficulty'), questions, answers)
+            )
+
+    def _unindex_paper(self, paper_id: int):
+        if self.fts_enabled:
+            self._conn.execute("DELETE FROM papers_fts WHERE rowid = ?", (paper_id,))
+
+    def _migrate(self, legacy_file: str):
+        """Import an old paper_history.json once, keeping its ids where they are unique"""
+        if not os.path.exists(legacy_file):
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._get_meta("migrated_from") is None:
+                    with open(legacy_file, 'r') as f:
+                        papers = json.load(f)
+                    before = self._conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+                    taken = {row[0] for row in self._conn.execute("SELECT id FROM papers")}
+                    renumber = []
+                    for p in papers:
+                        values = (p['timestamp'], p['questions'], p['answers'],
+                                  json.dumps(p.get('metadata') or {}))
+                        if isinstance(p.get('id'), int) and p['id'] not in taken:
+                            taken.add(p['id'])
+                            self._conn.execute(
+                                "INSERT INTO papers (id, timestamp, questions, answers, metadata) "
+                                "VALUES (?, ?, ?, ?, ?)", (p['id'],) + values
+                            )
+                        else:
+                            renumber.append(values)
+                    # The old len(history) + 1 ids repeat after a delete; give repeats new ids, don't drop them
+                    self._conn.executemany(
+                        "INSERT INTO papers (timestamp, questions, answers, metadata) VALUES (?, ?, ?, ?)",
+                        renumber
+                    )
+                    imported = self._conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0] - before
+                    if imported != len(papers):
+                        raise RuntimeError(f"History migration imported {imported} of {len(papers)} papers")
+                    self._set_meta("migrated_from", legacy_file)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @staticmethod
+    def _to_paper(row) -> Dict:
+        paper = {
+            'id': row['id'],
+            'timestamp': row['timestamp'],
+            'questions': row['questions'],
+            'answers': row['answers'],
+            'metadata': json.loads(row['metadata']) if row['metadata'] else {}
+        }
+        if row['paper_json']:
+            paper['paper'] = json.loads(row['paper_json'])
+        return paper
+
+    def add(self, timestamp: str, questions: str, answers: Optional[str], metadata: Optional[Dict],
+            paper: Optional[Dict] = None) -> int:
+        """Append a paper and return its id; paper is the optional structured form"""
+        metadata = metadata or {}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "INSERT INTO papers (timestamp, questions, answers, metadata, paper_json) VALUES (?, ?, ?, ?, ?)",
+                    (timestamp, questions, answers, json.dumps(metadata),
+                     json.dumps(paper) if paper is not None else None)
+                )
+                self._index_paper(cursor.lastrowid, questions, answers, metadata)
+                self._update_statistics(timestamp, metadata, 1)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return cursor.lastrowid
+
+    def get(self, paper_id: int) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM papers WHERE id = ? AND deleted = 0", (paper_id,)
+            ).fetchone()
+        return self._to_paper(row) if row else None
+
+    def all(self) -> List[Dict]:
+        """Return every live paper in insertion order"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM papers WHERE deleted = 0 ORDER BY id").fetchall()
+        return [self._to_paper(row) for row in rows]
+
+    @staticmethod
+    def _bound(value: Union[date, datetime, str, None], inclusive_end: bool = False) -> Optional[str]:
+        """Convert a date filter to the sortable 'YYYY-MM-DD HH:MM:SS' timestamp format"""
+        if value is None:
+            return None
+        if isinstance(value, datetime):
+            return value.strftime("%Y-%m-%d %H:%M:%S")
+        if isinstance(value, date):
+            # A whole day: 'until' covers everything before the next midnight
+            return (value + timedelta(days=1) if inclusive_end else value).strftime("%Y-%m-%d")
+        return value
+
+    def list(self, offset: int = 0, limit: int = 20, since=None, until=None,
+             query: Optional[str] = None) -> Dict:
+        """Newest-first page of paper summaries (no question/answer bodies).
+
+        since/until are dates (inclusive) or datetimes; query restricts the page
+        to full-text matches. Returns {'total': int, 'offset': int, 'papers': [...]};
+        an offset past the last match is moved back to the last page.
+        """
+        conditions = ["p.deleted = 0"]
+        params = []
+        since, until = self._bound(since), self._bound(until, inclusive_end=True)
+        if since:
+            conditions.append("p.timestamp >= ?")
+            params.append(since)
+        if until:
+            conditions.append("p.timestamp < ?")
+            params.append(until)
+
+        expression = None
+        if query:
+            expression = self._match_expression(query)
+            if not expression:
+                return {'total': 0, 'offset': 0, 'papers': []}
+            if self.fts_enabled:
+                # A subquery runs the match once; a join re-runs it for every candidate row
+                conditions.append("p.id IN (SELECT rowid FROM papers_fts WHERE papers_fts MATCH ?)")
+                params.append(expression)
+            else:
+                conditions.append("(lower(p.metadata) LIKE ? OR lower(p.questions) LIKE ?)")
+                params.extend([f"%{query.lower()}%"] * 2)
+
+        where = " AND ".join(conditions)
+        with self._lock:
+            total = self._count(where, params)
+            if total and offset >= total:
+                offset = (total - 1) // limit * limit
+            rows = self._conn.execute(
+                f"SELECT p.id, p.timestamp, p.metadata, p.answers IS NOT NULL AS has_answers "
+                f"FROM papers p WHERE {where} "
+                f"ORDER BY p.timestamp DESC, p.id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+            snippets = {}
+            if expression and self.fts_enabled and rows:
+                # snippet() is expensive, so build it for this page only rather than every match
+                ids = [row['id'] for row in rows]
+                snippets = dict(self._conn.execute(
+                    f"SELECT rowid, snippet(papers_fts, -1, '**', '**', ' … ', 16) FROM papers_fts "
+                    f"WHERE papers_fts MATCH ? AND rowid IN ({','.join('?' * len(ids))})",
+                    [expression] + ids
+                ).fetchall())
+        return {
+            'total': total,
+            'offset': offset,
+            'papers': [{
+                'id': row['id'],
+                'timestamp': row['timestamp'],
+                'metadata': json.loads(row['metadata']) if row['metadata'] else {},
+                'has_answers': bool(row['has_answers']),
+                'snippet': snippets.get(row['id'])
+            } for row in rows]
+        }
+
+    def _count(self, where: str, params: List) -> int:
+        """Matching papers for a filter, counted once per filter until papers are added or deleted"""
+        version = self._conn.execute(
+            "SELECT (SELECT MAX(id) FROM papers), (SELECT value FROM meta WHERE key = 'stats_papers')"
+        ).fetchone()
+        key = (where, tuple(params))
+        cached = self._totals.get(key)
+        if cached and cached[0] == tuple(version):
+            return cached[1]
+        total = self._conn.execute(f"SELECT COUNT(*) FROM papers p WHERE {where}", params).fetchone()[0]
+        if len(self._totals) >= 64:
+            self._totals.clear()
+        self._totals[key] = (tuple(version), total)
+        return total
+
+    def recent(self, limit: Optional[int] = None) -> List[Dict]:
+        """Full papers, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM papers WHERE deleted = 0 ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (limit if limit else -1,)
+            ).fetchall()
+        return [self._to_paper(row) for row in rows]
+
+    def delete(self, paper_id: int) -> bool:
+        """Tombstone a paper; compact once enough tombstones accumulate"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "UPDATE papers SET deleted = 1 WHERE id = ? AND deleted = 0", (paper_id,)
+                )
+                if cursor.rowcount:
+                    self._unindex_paper(paper_id)
+                    row = self._conn.execute(
+                        "SELECT timestamp, metadata FROM papers WHERE id = ?", (paper_id,)
+                    ).fetchone()
+                    metadata = json.loads(row['metadata']) if row['metadata'] else {}
+                    self._update_statistics(row['timestamp'], metadata, -1)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if cursor.rowcount == 0:
+                return False
+            tombstones = self._conn.execute(
+                "SELECT COUNT(*) FROM papers WHERE deleted = 1"
+            ).fetchone()[0]
+            if tombstones >= self.compact_threshold:
+                self._compact()
+            return True
+
+    def statistics(self) -> Dict:
+        """Read the running aggregates; cost does not grow with the number of papers"""
+        with self._lock:
+            papers = int(float(self._get_meta("stats_papers") or 0))
+            marks_sum = float(self._get_meta("stats_marks_sum") or 0)
+            counts = {'subject': {}, 'difficulty': {}}
+            for row in self._conn.execute(
+                "SELECT field, value, count FROM stats_counts WHERE count > 0 ORDER BY count DESC"
+            ):
+                counts[row['field']][row['value']] = row['count']
+        return {
+            'total_papers': papers,
+            'papers_by_subject': counts['subject'],
+            'papers_by_difficulty': counts['difficulty'],
+            'average_marks': marks_sum / papers if papers else 0
+        }
+
+    def papers_per_day(self, since: Optional[date] = None) -> List[Dict]:
+        """Daily paper counts in date order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, count FROM stats_daily WHERE count > 0 AND day >= ? ORDER BY day",
+                (since.strftime("%Y-%m-%d") if since else "",)
+            ).fetchall()
+        return [{'date': row['day'], 'count': row['count']} for row in rows]
+
+    def compact(self):
+        """Purge tombstoned papers and release their pages"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        self._conn.execute("DELETE FROM papers WHERE deleted = 1")
+        self._conn.execute("PRAGMA incremental_vacuum")
+
+    @staticmethod
+    def _match_expression(query: str) -> str:
+        """Turn free text into an FTS5 query where every word must match as a prefix"""
+        words = re.findall(r"\w+", query.lower())
+        return " ".join(f'"{word}"*' for word in words)
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> Dict:
+        """Ranked full-text search over metadata, questions and answers.
+
+        Returns {'total': int, 'hits': [...]} where each hit carries the paper id,
+        timestamp, metadata, a highlighted snippet and its rank score.
+        """
+        expression = self._match_expression(query)
+        if not expression:
+            return {'total': 0, 'hits': []}
+        if not self.fts_enabled:
+            return self._search_fallback(query, offset, limit)
+
+        with self._lock:
+            total = self._conn.execute(
+                "SELECT COUNT(*) FROM papers_fts WHERE papers_fts MATCH ?", (expression,)
+            ).fetchone()[0]
+            # bm25 weights favour subject/topic hits over matches deep in the body
+            rows = self._conn.execute("""
+                SELECT p.id, p.timestamp, p.metadata,
+                       snippet(papers_fts, -1, '**', '**', ' … ', 16) AS snippet,
+                       bm25(papers_fts, 5.0, 5.0, 2.0, 1.0, 0.5) AS score
+                FROM papers_fts JOIN papers p ON p.id = papers_fts.rowid
+                WHERE papers_fts MATCH ?
+                ORDER BY score
+                LIMIT ? OFFSET ?
+            """, (expression, limit, offset)).fetchall()
+        return {
+            'total': total,
+            'hits': [{
+                'id': row['id'],
+                'timestamp': row['timestamp'],
+                'metadata': json.loads(row['metadata']) if row['metadata'] else {},
+                'snippet': row['snippet'],
+                'score': row['score']
+            } for row in rows]
+        }
+
+    def _search_fallback(self, query: str, offset: int, limit: int) -> Dict:
+        """Unranked LIKE scan for SQLite builds without FTS5"""
+        pattern = f"%{query.lower()}%"
+        where = ("deleted = 0 AND (lower(metadata) LIKE ? OR lower(questions) LIKE ? "
+                 "OR lower(answers) LIKE ?)")
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) FROM papers WHERE {where}", (pattern,) * 3
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT id, timestamp, metadata, substr(questions, 1, 200) AS snippet FROM papers "
+                f"WHERE {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+                (pattern,) * 3 + (limit, offset)
+            ).fetchall()
+        return {
+            'total': total,
+            'hits': [{
+                'id': row['id'],
+                'timestamp': row['timestamp'],
+                'metadata': json.loads(row['metadata']) if row['metadata'] else {},
+                'snippet': row['snippet'],
+                'score': 0.0
+            } for row in rows]
+        }
@@ -0,0 +1,301 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from response_cache import make_cache_key
+from storage import connect
+import tracing
+
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "failed", "cancelled")
+
+
+async def run_generation(job_id: str, requirements: Dict, mode: str) -> Tuple[str, Optional[Dict]]:
+    """Default job runner: a coroutine run on the shared async backend"""
+    from async_generator import get_async_generator
+    from paper_model import parse_paper
+
+    generator = get_async_generator()
+    if mode == "parallel":
+        paper = await generator.generate_paper(requirements)
+        return paper.to_text(), paper.to_dict()
+    output, _ = await generator.get_output(requirements)
+    return output, parse_paper(output).to_dict()
+
+
+class JobQueue:
+    """SQLite-backed queue of generation jobs run on the shared event loop.
+
+    Jobs outlive the Streamlit rerun that submitted them, so a refresh or a
+    widget interaction no longer throws away a paid-for generation. Any
+    process that opens the same database can run jobs; they are claimed
+    inside a write transaction so each runs once. Submitting requirements
+    identical to a queued or running job returns that job instead.
+
+    One thread per process claims jobs and hands them to the event loop as
+    coroutines, so up to max_running jobs (by default the async backend's
+    max_concurrency) are in flight without a thread blocked on each.
+    """
+
+    def __init__(self, db_file: str = "jobs.db", runner: Optional[Callable] = None,
+                 stale_after: float = 15 * 60, max_running: Optional[int] = None):
+        self.db_file = db_file
+        self.runner = runner or run_generation
+        self.stale_after = stale_after
+        self.max_running = max_running
+        self._lock = threading.Lock()
+        self._conn = connect(db_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                requirements TEXT NOT NULL,
+                metadata TEXT,
+                status TEXT NOT NULL,
+                paper_id INTEGER,
+                error TEXT,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs(key, status)")
+        self._worker = None
+        self._slots = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        # Finishing a job writes to SQLite, which must not happen on the event loop
+        self._finisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-finish")
+
+    def _write(self, sql: str, params: Tuple = ()) -> int:
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def submit(self, requirements: Dict, mode: str = "standard", metadata: Optional[Dict] = None) -> str:
+        """Queue a generation and return its job id, reusing an identical active job"""
+        key = make_cache_key(dict(requirements, mode=mode), "jobs", namespace="job")
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE key = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                    (key,) + ACTIVE
+                ).fetchone()
+                if row:
+                    job_id = row['id']
+                else:
+                    job_id = uuid.uuid4().hex
+                    self._conn.execute(
+                        "INSERT INTO jobs (id, key, mode, requirements, metadata, status, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                        (job_id, key, mode, json.dumps(requirements), json.dumps(metadata or {}), time.time())
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, mode, status, paper_id, error, created_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        if job['status'] in ACTIVE:
+            # Nothing runs a job left over from a previous process until a worker is started here
+            self.start()
+        if job['status'] == "queued":
+            with self._lock:
+                job['position'] = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (row['created_at'],)
+                ).fetchone()[0]
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a queued job or interrupt a running one.
+
+        A job running in another process is only marked 'cancelling' here;
+        that process's worker sees the mark and interrupts it.
+        """
+        if self._write("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                       (time.time(), job_id)):
+            return True
+        if self._write("UPDATE jobs SET status = 'cancelling' WHERE id = ? AND status = 'running'", (job_id,)):
+            from async_generator import cancel
+            cancel(job_id)
+            return True
+        return False
+
+    def _claim(self, worker: str) -> Optional[Dict]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs left running by a worker that died are put back in line
+                stale = time.time() - self.stale_after
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND started_at < ?",
+                    (stale,)
+                )
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE status = 'cancelling' AND started_at < ?",
+                    (time.time(), stale)
+                )
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, started_at = ? WHERE id = ?",
+                        (worker, time.time(), row['id'])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return dict(row) if row else None
+
+    def _finish(self, job_id: str, status: str, paper_id: Optional[int] = None, error: Optional[str] = None,
+                only_if: Optional[str] = None) -> bool:
+        """Record a job's outcome; with only_if, only while the job is still in that status"""
+        sql = "UPDATE jobs SET status = ?, paper_id = ?, error = ?, finished_at = ? WHERE id = ?"
+        params = (status, paper_id, error, time.time(), job_id)
+        if only_if:
+            sql += " AND status = ?"
+            params += (only_if,)
+        return bool(self._write(sql, params))
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row) and row['status'] in ("cancelling", "cancelled")
+
+    def _interrupt_cancelled(self, worker: str):
+        """Interrupt this process's jobs that were cancelled from another process"""
+        from async_generator import cancel
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'cancelling' AND worker = ?", (worker,)
+            ).fetchall()
+        for row in rows:
+            cancel(row['id'])
+
+    def _fail(self, job_id: str, error: str):
+        cancelled = self.status(job_id)['status'] == "cancelling"
+        self._finish(job_id, "cancelled" if cancelled else "failed", error=error)
+
+    async def _execute(self, job: Dict) -> Tuple[str, Optional[Dict]]:
+        with tracing.trace("job", mode=job['mode'], job_id=job['id']):
+            return await self.runner(job['id'], json.loads(job['requirements']), job['mode'])
+
+    def _run(self, job: Dict):
+        """Schedule a claimed job on the shared loop, keyed by job id for cancellation"""
+        from async_generator import cancel, get_async_generator
+
+        if self._cancel_requested(job['id']):
+            self._finish(job['id'], "cancelled", error="Generation was cancelled.")
+            self._slots.release()
+            return
+        future = get_async_generator().submit(self._execute(job), session_id=job['id'])
+        future.add_done_callback(lambda f: self._finisher.submit(self._complete, job, f))
+        # A cancel that came in before the future was registered had nothing to interrupt
+        if self._cancel_requested(job['id']):
+            cancel(job['id'])
+
+    def _complete(self, job: Dict, future: Future):
+        try:
+            if future.cancelled():
+                self._fail(job['id'], "Generation was cancelled.")
+            elif future.exception() is not None:
+                error = future.exception()
+                self._fail(job['id'], str(error) or type(error).__name__)
+            else:
+                self._save(job, *future.result())
+        except Exception as e:
+            print(f"Error finishing job: {str(e)}")
+            self._fail(job['id'], str(e) or type(e).__name__)
+        finally:
+            self._slots.release()
+            self._wakeup.set()
+
+    def _save(self, job: Dict, output: str, paper_dict: Optional[Dict]):
+        from shared_resources import get_history_manager
+        from paper_model import Paper
+
+        paper = Paper.from_dict(paper_dict) if paper_dict else None
+        if paper and paper.has_questions:
+            questions = paper.questions_markdown()
+            answers = "Answer Key\n\n" + paper.answers_markdown() if paper.has_answers else None
+            metadata = json.loads(job['metadata'] or '{}')
+        elif output.startswith("Error"):
+            self._fail(job['id'], output)
+            return
+        else:
+            questions, answers, metadata, paper_dict = output, None, None, None
+        if self._cancel_requested(job['id']):
+            self._finish(job['id'], "cancelled", error="Generation was cancelled.")
+            return
+        history = get_history_manager()
+        paper_id = history.add_paper(questions, answers, metadata, paper=paper_dict)
+        if not self._finish(job['id'], "done", paper_id=paper_id, only_if="running"):
+            # Cancelled while the paper was being saved
+            history.delete_paper(paper_id)
+            self._finish(job['id'], "cancelled", error="Generation was cancelled.")
+
+    def _work(self, worker: str):
+        while not self._stopping.is_set():
+            try:
+                self._interrupt_cancelled(worker)
+            except Exception as e:
+                print(f"Error checking cancelled jobs: {str(e)}")
+            # Only claim what this process can run, leaving the rest for other processes
+            if not self._slots.acquire(timeout=2.0):
+                continue
+            try:
+                job = self._claim(worker)
+            except Exception as e:
+                print(f"Error claiming job: {str(e)}")
+                job = None
+            if job is None:
+                self._slots.release()
+                self._wakeup.wait(timeout=2.0)
+                self._wakeup.clear()
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                print(f"Error starting job: {str(e)}")
+                self._fail(job['id'], str(e) or type(e).__name__)
+                self._slots.release()
+
+    def start(self):
+        """Start the claiming thread in this process, once"""
+        with self._lock:
+            if self._worker:
+                return
+            max_running = self.max_running
+            if max_running is None:
+                from async_generator import get_async_generator
+                max_running = get_async_generator().max_concurrency
+            self._slots = threading.BoundedSemaphore(max_running)
+            self._worker = threading.Thread(
+                target=self._work, args=(str(os.getpid()),), name="job-worker", daemon=True
+            )
+            self._worker.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
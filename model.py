@@ -1,75 +1,232 @@
-import google.generativeai as genai
 import streamlit as st
-import time
-from typing import Optional, Tuple, List, Dict
-from datetime import datetime, timedelta
+from typing import Any, Optional, Tuple, List, Dict, Iterator, Union
 import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dedup_index import DuplicateIndex
+from paper_model import Paper, Question, Section, answers_from_json, new_section, parse_paper, questions_from_json
+from model_backend import create_model
+from question_bank import QuestionBank
+from rate_limiter import SlidingWindowLimiter
+from response_cache import ResponseCache, make_cache_key
+from single_flight import flights, prompt_key
+import tracing
+from syllabus_index import select_syllabus, strip_paper_preamble
+
+MODEL_NAME = "gemini-1.5-pro"
+
+# (section type, requirements key, marks per question, heading), in paper order
+SECTIONS = [
+    ("MCQ", "num_mcq", 1, "Section A: Multiple Choice Questions"),
+    ("descriptive_3", "num_3_marks", 3, "Section B: Short Answer Questions"),
+    ("descriptive_5", "num_5_marks", 5, "Section C: Long Answer Questions"),
+]
+
+# Extra terms used to rank syllabus chunks for each section's prompt
+SECTION_QUERIES = {
+    "MCQ": "definitions terminology concepts properties types",
+    "descriptive_3": "explain compare algorithm steps working",
+    "descriptive_5": "design analysis implementation applications case study"
+}
+
+ANSWER_INSTRUCTIONS = {
+    "MCQ": """
+        1. The correct option letter only
+        2. A one-line explanation why it's correct
+    """,
+    "descriptive": """
+        - Main points in bullet form
+        - Essential steps/formulas if needed
+        - Keep it focused and clear
+        - Include only key concepts
+    """
+}
+
+ANSWER_PROMPTS = {
+    "MCQ": """
+        For this MCQ question:
+        {question}
+        
+        Provide:""" + ANSWER_INSTRUCTIONS["MCQ"],
+    "descriptive": """
+        For this question:
+        {question}
+        
+        Provide a concise answer with:""" + ANSWER_INSTRUCTIONS["descriptive"]
+}
+
+BATCH_ANSWER_PROMPT = """
+    Answer each of the following {count} questions.
+    For each answer provide:{instructions}
+    Start every answer on its own line with a heading of the form "### Answer N",
+    where N is the question number below, and write nothing before the first heading.
+
+    {questions}
+"""
 
 class APIRateLimiter:
-    def __init__(self, calls_per_minute=50):
+    def __init__(self, calls_per_minute=50, cache: Optional[ResponseCache] = None,
+                 shared_path: Optional[str] = "rate_limit.state"):
         self.calls_per_minute = calls_per_minute
-        self.calls = []
-        self.cache = {}  # Simple cache for responses
+        # Shared through a locked state file so every app worker on the host respects one budget
+        self.limiter = SlidingWindowLimiter(calls_per_minute, 60.0, shared_path=shared_path)
+        self.cache = cache if cache is not None else ResponseCache()
         
     def can_make_call(self) -> bool:
-        now = datetime.now()
-        # Remove calls older than 1 minute
-        self.calls = [call_time for call_time in self.calls 
-                     if now - call_time < timedelta(minutes=1)]
-        return len(self.calls) < self.calls_per_minute
+        return self.limiter.available()
     
-    def log_call(self):
-        self.calls.append(datetime.now())
+    def acquire(self, timeout: Optional[float] = 60.0) -> bool:
+        """Wait for a slot in the per-minute budget and consume it"""
+        start = time.perf_counter()
+        acquired = self.limiter.acquire(timeout)
+        tracing.count("limiter_wait_ms", (time.perf_counter() - start) * 1000)
+        return acquired
     
-    def get_cached_response(self, prompt: str) -> Optional[str]:
-        return self.cache.get(prompt)
+    async def acquire_async(self, timeout: Optional[float] = 60.0) -> bool:
+        start = time.perf_counter()
+        acquired = await self.limiter.acquire_async(timeout)
+        tracing.count("limiter_wait_ms", (time.perf_counter() - start) * 1000)
+        return acquired
     
-    def cache_response(self, prompt: str, response: str):
-        self.cache[prompt] = response
-        # Limit cache size to 1000 items
-        if len(self.cache) > 1000:
-            self.cache.pop(next(iter(self.cache)))
+    def get_cached_response(self, key: str) -> Optional[str]:
+        response = self.cache.get(key)
+        tracing.count("cache_hits" if response is not None else "cache_misses")
+        return response
+    
+    def cache_response(self, key: str, response: str):
+        # Size and age limits are enforced by the disk cache itself
+        self.cache.set(key, response)
+
+class SectionFill:
+    """Bookkeeping for filling one section: banked questions first, then generated ones.
+
+    Shared by the sync and async generators, which only differ in how they
+    sample the bank, call the model and save new questions.
+    """
+
+    def __init__(self, requirements: Dict, section_type: str, num_questions: int,
+                 seen: Optional[DuplicateIndex] = None):
+        self.subject = requirements.get("subject", "")
+        self.topic = requirements.get("topic", "")
+        self.difficulty = requirements.get("difficulty", "")
+        self.section_type = section_type
+        self.num_questions = num_questions
+        _, _, self.marks, _ = next(s for s in SECTIONS if s[0] == section_type)
+        # Indexes the questions already in this paper: near-duplicates of those are always dropped
+        self.seen = seen if seen is not None else DuplicateIndex()
+        self.questions: List[Question] = []
+        self.repeats: List[Question] = []
+
+    @property
+    def shortfall(self) -> int:
+        return self.num_questions - len(self.questions)
+
+    def _take(self, question: Question) -> bool:
+        if self.seen.find(question.text) is not None:
+            return False
+        self.seen.add(id(question), question.text)
+        self.questions.append(question)
+        return True
+
+    def add_banked(self, rows: List[Dict]):
+        for q in rows:
+            self._take(Question(number=0, text=q['text'], marks=self.marks, options=q['options'],
+                                answer=q['answer'], bank_id=q['id']))
+
+    def add_generated(self, generated: List[Question], banked: List[Optional[int]]) -> List[Question]:
+        """Take generated questions that repeat nothing banked; returns them, to be banked"""
+        shortfall = self.shortfall
+        fresh = []
+        for question, match in zip(generated, banked):
+            if len(fresh) >= shortfall:
+                break
+            if match is not None:
+                self.repeats.append(question)
+            elif self._take(question):
+                fresh.append(question)
+        return fresh
+
+    def finish(self) -> List[Question]:
+        # A repeat of an older paper's question beats a short section
+        for question in self.repeats:
+            if len(self.questions) >= self.num_questions:
+                break
+            self._take(question)
+        for number, question in enumerate(self.questions, 1):
+            question.number = number
+        return self.questions
+
 
 class QuestionPaperGenerator:
-    def __init__(self):
-        self.model = self.load_model()
+    def __init__(self, max_workers: int = 3, syllabus_token_budget: int = 1500, model: Any = None):
+        # Any object with generate_content(_async) will do, e.g. model_backend.FakeGenerativeModel
+        self._model = model
+        self._question_bank = None
+        self._load_lock = threading.Lock()
         self.rate_limiter = APIRateLimiter()
-        self.load_question_bank()
+        self.max_workers = max_workers
+        self.syllabus_token_budget = syllabus_token_budget
+
+    @property
+    def model(self) -> Optional[Any]:
+        # The client (and its SDK) loads on the first generation, not at startup
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self.load_model()
+        return self._model
+
+    @property
+    def question_bank(self) -> QuestionBank:
+        if self._question_bank is None:
+            with self._load_lock:
+                if self._question_bank is None:
+                    self._question_bank = self.load_question_bank()
+        return self._question_bank
         
-    def load_model(self) -> Optional[genai.GenerativeModel]:
+    def load_model(self) -> Optional[Any]:
         try:
-            api_key = open("api_key.txt","r").read()
-            genai.configure(api_key=api_key)
-            return genai.GenerativeModel("gemini-1.5-pro")
+            return create_model(MODEL_NAME)
         except Exception as e:
             st.error(f"Error loading model: {str(e)}")
             return None
     
-    def load_question_bank(self):
-        try:
-            with open('question_bank.json', 'r') as f:
-                self.question_bank = json.load(f)
-        except FileNotFoundError:
-            self.question_bank = {}
-            self.save_question_bank()
-    
-    def save_question_bank(self):
-        with open('question_bank.json', 'w') as f:
-            json.dump(self.question_bank, f, indent=4)
+    def load_question_bank(self) -> QuestionBank:
+        # Indexed SQLite store; the old question_bank.json is imported once
+        return QuestionBank("question_bank.db", legacy_file="question_bank.json")
     
-    def get_from_question_bank(self, subject: str, topic: str, question_type: str) -> List[str]:
-        return self.question_bank.get(subject, {}).get(topic, {}).get(question_type, [])
+    def get_from_question_bank(self, subject: str, topic: str, question_type: str,
+                               limit: int = 20, difficulty: Optional[str] = None,
+                               strategy: str = "lru") -> List[str]:
+        questions = self.question_bank.sample(subject, topic, question_type, limit,
+                                              difficulty=difficulty, strategy=strategy)
+        return [question['text'] for question in questions]
     
-    def add_to_question_bank(self, subject: str, topic: str, question_type: str, questions: List[str]):
-        if subject not in self.question_bank:
-            self.question_bank[subject] = {}
-        if topic not in self.question_bank[subject]:
-            self.question_bank[subject][topic] = {}
-        if question_type not in self.question_bank[subject][topic]:
-            self.question_bank[subject][topic][question_type] = []
-        
-        self.question_bank[subject][topic][question_type].extend(questions)
-        self.save_question_bank()
+    def add_to_question_bank(self, subject: str, topic: str, question_type: str,
+                             questions: List[Union[str, Question]], difficulty: str = ''):
+        self.question_bank.add(subject, topic, question_type, questions, difficulty=difficulty)
+
+    def prepare_syllabus(self, requirements: Dict, section_type: Optional[str] = None) -> Tuple[str, Dict]:
+        """Trim the syllabus to the chunks most relevant to this paper or section"""
+        query = " ".join([
+            requirements.get('subject', ''),
+            requirements.get('topic', ''),
+            SECTION_QUERIES.get(section_type, "")
+        ])
+        return select_syllabus(requirements.get('syllabus', ''), query, self.syllabus_token_budget)
+
+    def syllabus_report(self, requirements: Dict, parallel: bool = False) -> Dict:
+        """Prompt tokens spent on the syllabus for one request, before and after trimming"""
+        if not parallel:
+            return dict(self.prepare_syllabus(requirements)[1])
+        report = {'original_tokens': 0, 'selected_tokens': 0, 'saved_tokens': 0}
+        for section_type, key, _, _ in SECTIONS:
+            if requirements[key] > 0:
+                for field, value in self.prepare_syllabus(requirements, section_type)[1].items():
+                    report[field] += value
+        return report
 
     def format_question_prompt(self, requirements: Dict) -> str:
         total_marks = (
@@ -92,7 +249,7 @@ class QuestionPaperGenerator:
 
         Subject: {requirements.get('subject', '')}
         Topic: {requirements.get('topic', '')}
-        Syllabus Coverage: {requirements.get('syllabus', '')}
+        Syllabus Coverage: {self.prepare_syllabus(requirements)[0]}
         Difficulty Level: {requirements.get('difficulty', 'Medium')}
 
         Question Distribution:
@@ -131,7 +288,7 @@ class QuestionPaperGenerator:
         return f"""
         Generate a detailed answer key for this question paper:
 
-        {questions}
+        {strip_paper_preamble(questions)}
 
         Format the answers as follows:
 
@@ -165,12 +322,187 @@ class QuestionPaperGenerator:
         - Focused on key points
         """
 
+    def paper_header(self, requirements: Dict) -> Tuple[str, List[str]]:
+        total_marks = sum(requirements[key] * marks for _, key, marks, _ in SECTIONS)
+        title = f"{requirements.get('subject', '').upper()} EXAMINATION"
+        return title, [
+            f"Time: 3 Hours                                                  Maximum Marks: {total_marks}",
+            "Instructions:",
+            "1. All questions are compulsory",
+            "2. Write answers clearly and neatly",
+            "3. Start each section on a new page",
+            "4. Numbers to the right indicate full marks",
+            f"Subject: {requirements.get('subject', '')}",
+            f"Topic: {requirements.get('topic', '')}",
+            f"Difficulty Level: {requirements.get('difficulty', 'Medium')}"
+        ]
+
+    def format_section_prompt(self, requirements: Dict, section_type: str, num_questions: int) -> str:
+        _, _, marks, heading = next(s for s in SECTIONS if s[0] == section_type)
+        if section_type == "MCQ":
+            style = """- Clear question stem
+           - Four distinct options (a, b, c, d)
+           - No ambiguous or overlapping options"""
+        elif section_type == "descriptive_3":
+            style = """- Clear, focused questions
+           - Include computational/analytical questions"""
+        else:
+            style = """- Complex analytical questions
+           - Include case studies/scenarios
+           - Clear sub-parts if needed"""
+
+        return f"""
+        Generate only the following section of a question paper.
+
+        Subject: {requirements.get('subject', '')}
+        Topic: {requirements.get('topic', '')}
+        Syllabus Coverage: {self.prepare_syllabus(requirements, section_type)[0]}
+        Difficulty Level: {requirements.get('difficulty', 'Medium')}
+
+        {heading} ({num_questions} × {marks} = {num_questions * marks} marks)
+
+        Write exactly {num_questions} questions with:
+           {style}
+
+        Return JSON only, in this form:
+        {{"questions": [{{"text": "question stem", "options": ["first", "second", "third", "fourth"], "marks": {marks}}}]}}
+        Leave "options" empty for questions that are not multiple choice, and do not
+        put numbers or option letters inside the text.
+        """
+
+    def format_section_answer_prompt(self, section_type: str, questions: str) -> str:
+        if section_type == "MCQ":
+            guidance = """* Write correct option letter
+          * Add brief explanation (1-2 lines)
+          * Include key concept tested"""
+        elif section_type == "descriptive_3":
+            guidance = """* Main points in bullet form
+          * Essential formulas/steps
+          * Key concepts and definitions"""
+        else:
+            guidance = """* Detailed solution outline
+          * Step-by-step approach
+          * Important concepts/theorems"""
+
+        return f"""
+        Generate the answer key for this section of a question paper:
+
+        {questions}
+
+        For each question, using its number:
+          {guidance}
+
+        Make answers clear, concise and well-structured.
+        Return JSON only, in this form:
+        {{"answers": [{{"number": 1, "answer": "answer text"}}]}}
+        """
+
+    def _parse_generated_questions(self, reply: str, section_type: str) -> List[Question]:
+        try:
+            return questions_from_json(reply, section_type)
+        except ValueError:
+            # The model ignored the JSON instructions: fall back to the text parser
+            section = new_section(section_type)
+            parsed = parse_paper(f"{section.title}\n{reply}")
+            questions = [q for s in parsed.sections for q in s.questions if q.text]
+            if not questions:
+                raise
+            return questions
+
+    @staticmethod
+    def section_cache_key(requirements: Dict, section_type: str, num_questions: int, round_number: int = 0) -> str:
+        # The round is part of the key so a retry for a shortfall asks the model again
+        return make_cache_key(
+            {"requirements": requirements, "section": section_type, "count": num_questions,
+             "difficulty": requirements.get("difficulty", ""), "round": round_number},
+            MODEL_NAME, namespace="section"
+        )
+
+    def fill_section_questions(self, requirements: Dict, section_type: str, num_questions: int,
+                               seen: Optional[DuplicateIndex] = None, max_rounds: int = 2) -> List[Question]:
+        """Take questions from the bank first and generate only the shortfall.
+
+        Banked questions keep their stored answer; new ones have answer None.
+        seen indexes the questions already in this paper: near-duplicates of
+        those are always dropped, and generated near-duplicates of banked
+        questions are only used when max_rounds of generation fall short.
+        """
+        fill = SectionFill(requirements, section_type, num_questions, seen)
+        fill.add_banked(self.question_bank.sample(
+            fill.subject, fill.topic, section_type, num_questions, difficulty=fill.difficulty
+        ))
+        for round_number in range(max_rounds):
+            shortfall = fill.shortfall
+            if shortfall <= 0:
+                break
+            reply = self._generate_text(
+                self.format_section_prompt(requirements, section_type, shortfall),
+                cache_key=self.section_cache_key(requirements, section_type, shortfall, round_number),
+                json_mode=True
+            )
+            generated = self._parse_generated_questions(reply, section_type)
+            fresh = fill.add_generated(generated, self.question_bank.find_near_duplicates([q.text for q in generated]))
+            self.add_to_question_bank(fill.subject, fill.topic, section_type, fresh, difficulty=fill.difficulty)
+        return fill.finish()
+
+    @staticmethod
+    def blank_section(section_type: str) -> Section:
+        return new_section(section_type, title=next(s[3] for s in SECTIONS if s[0] == section_type))
+
+    def format_missing_answers_prompt(self, section_type: str, missing: List[Question]) -> str:
+        """The section answer prompt for the questions that have no stored answer"""
+        section = self.blank_section(section_type)
+        section.questions = [
+            Question(number=n, text=q.text, marks=q.marks, options=q.options) for n, q in enumerate(missing, 1)
+        ]
+        return self.format_section_answer_prompt(section_type, Paper(sections=[section]).questions_markdown())
+
+    @staticmethod
+    def question_with_options(question: Question) -> str:
+        return question.text + "".join(f"\n({chr(97 + i)}) {o}" for i, o in enumerate(question.options))
+
+    def answer_section(self, requirements: Dict, section_type: str, questions: List[Question]):
+        """Answer the questions that have no stored answer in one request and bank the answers"""
+        missing = [q for q in questions if not q.answer]
+        if not missing:
+            return
+
+        try:
+            parts = answers_from_json(self._generate_text(
+                self.format_missing_answers_prompt(section_type, missing), json_mode=True
+            ))
+        except Exception:
+            parts = {}
+
+        # Anything the section reply did not cover is answered on its own, concurrently like generate_answers
+        pending = {n: question for n, question in enumerate(missing, 1) if not parts.get(n)}
+        if pending:
+            answer = tracing.bind(
+                lambda question: self._answer_question(self.question_with_options(question), section_type, 2)
+            )
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                parts.update(zip(pending, executor.map(answer, pending.values())))
+        self.save_answers(requirements, section_type, missing, parts)
+
+    def save_answers(self, requirements: Dict, section_type: str, missing: List[Question], parts: Dict[int, str]):
+        """Set each missing question's answer from parts (keyed by its position) and bank them.
+
+        Sampled questions are saved by their row id, newly generated ones by
+        text under the paper's key.
+        """
+        for n, question in enumerate(missing, 1):
+            question.answer = parts[n]
+        by_id = {q.bank_id: q.answer for q in missing if q.bank_id is not None}
+        by_text = {q.text: q.answer for q in missing if q.bank_id is None}
+        if by_id:
+            self.question_bank.set_answers(by_id)
+        if by_text:
+            self.question_bank.set_answers_by_text(
+                requirements.get("subject", ""), requirements.get("topic", ""), section_type,
+                requirements.get("difficulty", ""), by_text
+            )
+
     def generate_section_questions(self, requirements: Dict, section_type: str) -> Tuple[str, List[str]]:
-        # Try to get questions from question bank first
-        subject = requirements.get("subject", "")
-        topic = requirements.get("topic", "")
-        stored_questions = self.get_from_question_bank(subject, topic, section_type)
-        
         num_questions = {
             "MCQ": requirements["num_mcq"],
             "descriptive_3": requirements["num_3_marks"],
@@ -180,109 +512,291 @@ class QuestionPaperGenerator:
         if num_questions == 0:
             return "", []
 
-        if stored_questions and len(stored_questions) >= num_questions:
-            # Use stored questions if available
-            selected_questions = stored_questions[:num_questions]
-            return "\n\n".join(selected_questions), selected_questions
-
-        # Generate new questions if needed
-        prompt = self.format_question_prompt(requirements)
-        
-        # Check cache first
-        cached_response = self.rate_limiter.get_cached_response(prompt)
-        if cached_response:
-            questions = cached_response.strip().split("\n\n")
-            return "\n\n".join(questions), questions
-
-        # Check rate limiting
-        if not self.rate_limiter.can_make_call():
-            time.sleep(2)  # Wait if rate limit reached
-            
-        response = self.model.generate_content(prompt)
-        self.rate_limiter.log_call()
-        
-        questions = response.text.strip().split("\n\n")
-        self.rate_limiter.cache_response(prompt, response.text)
-        
-        # Store new questions in question bank
-        self.add_to_question_bank(subject, topic, section_type, questions)
-        
+        # Numbered, with MCQ options on their own lines, as the model used to write them
+        questions = [
+            f"{q.number}. {self.question_with_options(q)}"
+            for q in self.fill_section_questions(requirements, section_type, num_questions)
+        ]
         return "\n\n".join(questions), questions
 
-    def generate_answers(self, questions: List[str], question_type: str) -> str:
-        answer_prompts = {
-            "MCQ": """
-                For this MCQ question:
-                {question}
-                
-                Provide:
-                1. The correct option letter only
-                2. A one-line explanation why it's correct
-            """,
-            "descriptive": """
-                For this question:
-                {question}
-                
-                Provide a concise answer with:
-                - Main points in bullet form
-                - Essential steps/formulas if needed
-                - Keep it focused and clear
-                - Include only key concepts
-            """
-        }
-        
-        answers = []
-        for i, question in enumerate(questions, 1):
-            prompt = answer_prompts["MCQ" if question_type == "MCQ" else "descriptive"]
-            response = self.model.generate_content(prompt.format(question=question))
-            answers.append(f"Q{i}. {response.text.strip()}")
-        
-        return "\n\n".join(answers)
+    def _generate_with_retry(self, prompt: str, cache_key: Optional[str] = None, max_retries: int = 2) -> str:
+        for attempt in range(max_retries + 1):
+            try:
+                return self._generate_text(prompt, cache_key)
+            except Exception:
+                if attempt == max_retries:
+                    raise
+                time.sleep(2 ** attempt)  # Back off before retrying
 
-    def get_output(self, requirements: Dict) -> Tuple[str, bool]:
-        if not self.model:
-            return "Error: Could not load the AI model. Please check your API key.", False
-        
+    def _answer_cache_key(self, question: str, question_type: str) -> str:
+        return make_cache_key({"question": question, "type": question_type}, MODEL_NAME, namespace="answer")
+
+    def _answer_question(self, question: str, question_type: str, max_retries: int) -> str:
+        prompt = ANSWER_PROMPTS["MCQ" if question_type == "MCQ" else "descriptive"]
         try:
-            # Check cache first
-            cache_key = str(requirements)
+            return self._generate_with_retry(
+                prompt.format(question=question),
+                self._answer_cache_key(question, question_type),
+                max_retries
+            )
+        except Exception as e:
+            return f"Answer unavailable: {str(e)}"
+
+    def _answer_batch(self, questions: List[str], question_type: str, max_retries: int) -> List[str]:
+        if len(questions) == 1:
+            return [self._answer_question(questions[0], question_type, max_retries)]
+
+        # Reuse answers we already have and only pack the rest into one prompt
+        answers = [self.rate_limiter.get_cached_response(self._answer_cache_key(q, question_type))
+                   for q in questions]
+        pending = [i for i, answer in enumerate(answers) if not answer]
+        if pending:
+            numbered = "\n\n".join(f"Question {n}:\n{questions[i]}" for n, i in enumerate(pending, 1))
+            prompt = BATCH_ANSWER_PROMPT.format(
+                count=len(pending),
+                instructions=ANSWER_INSTRUCTIONS["MCQ" if question_type == "MCQ" else "descriptive"],
+                questions=numbered
+            )
+            try:
+                parts = self._split_batch_answers(self._generate_with_retry(prompt, max_retries=max_retries))
+            except Exception:
+                parts = {}
+            for n, i in enumerate(pending, 1):
+                if parts.get(n):
+                    answers[i] = parts[n]
+                    self.rate_limiter.cache_response(self._answer_cache_key(questions[i], question_type), parts[n])
+                else:
+                    # Missing or unparseable in the packed reply: retry this one on its own
+                    answers[i] = self._answer_question(questions[i], question_type, max_retries)
+        return answers
+
+    @staticmethod
+    def _split_batch_answers(text: str) -> Dict[int, str]:
+        parts = {}
+        matches = list(re.finditer(r"^#+\s*Answer\s+(\d+)\s*:?\s*$", text, re.MULTILINE | re.IGNORECASE))
+        for match, following in zip(matches, matches[1:] + [None]):
+            end = following.start() if following else len(text)
+            parts[int(match.group(1))] = text[match.end():end].strip()
+        return parts
+
+    def generate_answers(self, questions: List[str], question_type: str, batch_size: int = 1,
+                         max_retries: int = 2) -> str:
+        """Answer questions concurrently, optionally packing batch_size questions per prompt"""
+        batch_size = max(1, batch_size)
+        batches = [questions[i:i + batch_size] for i in range(0, len(questions), batch_size)]
+
+        # executor.map keeps results in the original question order
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(lambda batch: self._answer_batch(batch, question_type, max_retries), batches)
+            answers = [answer for batch_answers in results for answer in batch_answers]
+
+        return "\n\n".join(f"Q{i}. {answer}" for i, answer in enumerate(answers, 1))
+
+    def _generate_text(self, prompt: str, cache_key: Optional[str] = None, json_mode: bool = False) -> str:
+        if cache_key:
             cached_response = self.rate_limiter.get_cached_response(cache_key)
             if cached_response:
-                return cached_response, True
+                return cached_response
+
+        def call() -> str:
+            if not self.rate_limiter.acquire():
+                raise RuntimeError("API rate limit reached. Please try again in a minute.")
+            with tracing.span("model.generate", json=json_mode):
+                if json_mode:
+                    response = self.model.generate_content(
+                        prompt, generation_config={"response_mime_type": "application/json"}
+                    )
+                else:
+                    response = self.model.generate_content(prompt)
+            text = response.text.strip()
+            tracing.record_usage(response, prompt, text)
+
+            if cache_key:
+                self.rate_limiter.cache_response(cache_key, text)
+            return text
+
+        # Sessions sending the same prompt at the same time share one call
+        return flights.do(cache_key or prompt_key(prompt, json_mode), call)
+
+    @staticmethod
+    def paper_sections(requirements: Dict) -> List[Tuple[str, int]]:
+        """(section type, question count) for each section the paper asks for, in order"""
+        return [(section_type, requirements[key]) for section_type, key, _, _ in SECTIONS if requirements[key] > 0]
+
+    @staticmethod
+    def paper_cache_key(requirements: Dict) -> str:
+        return make_cache_key(requirements, MODEL_NAME, namespace="paper_model")
+
+    def assemble_paper(self, requirements: Dict, sections: List[Section]) -> Paper:
+        title, header = self.paper_header(requirements)
+        return Paper(title=title, header=header, sections=list(sections))
+
+    def _generate_section(self, requirements: Dict, section_type: str, num_questions: int,
+                          seen: Optional[DuplicateIndex] = None) -> Section:
+        section = self.blank_section(section_type)
+        with tracing.span("section.questions", section=section_type):
+            section.questions = self.fill_section_questions(requirements, section_type, num_questions, seen=seen)
+        if requirements.get("with_answers", True):
+            # Answer this section right away instead of waiting for the other sections
+            with tracing.span("section.answers", section=section_type):
+                self.answer_section(requirements, section_type, section.questions)
+        return section
+
+    def generate_paper(self, requirements: Dict) -> Paper:
+        """Build a structured paper, generating sections (and their answers) concurrently"""
+        with tracing.trace("generate", mode="parallel", subject=requirements.get("subject", "")):
+            return self._generate_paper(requirements)
+
+    def _generate_paper(self, requirements: Dict) -> Paper:
+        if not self.model:
+            raise RuntimeError("Could not load the AI model. Please check your API key.")
+
+        cache_key = self.paper_cache_key(requirements)
+        cached_response = self.rate_limiter.get_cached_response(cache_key)
+        if cached_response:
+            return Paper.from_dict(json.loads(cached_response))
+
+        def build() -> str:
+            # Shared across sections so no question appears twice in the paper
+            seen = DuplicateIndex()
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(tracing.bind(self._generate_section), requirements, section_type, count, seen)
+                    for section_type, count in self.paper_sections(requirements)
+                ]
+                paper = self.assemble_paper(requirements, [future.result() for future in futures])
+
+            text = json.dumps(paper.to_dict())
+            self.rate_limiter.cache_response(cache_key, text)
+            return text
+
+        # Concurrent identical requests wait for one build; each gets its own copy
+        return Paper.from_dict(json.loads(flights.do(cache_key, build)))
+
+    def get_output_parallel(self, requirements: Dict) -> Tuple[str, bool]:
+        """Generate each section (and its answers) concurrently, then assemble in order"""
+        try:
+            return self.generate_paper(requirements).to_text(), True
+        except Exception as e:
+            return f"Error generating content: {str(e)}", False
+
+    def _stream_text(self, prompt: str) -> Iterator[str]:
+        if not self.rate_limiter.acquire():
+            raise RuntimeError("API rate limit reached. Please try again in a minute.")
+        chunk, text = None, []
+        with tracing.span("model.stream"):
+            for chunk in self.model.generate_content(prompt, stream=True):
+                if chunk.parts:
+                    text.append(chunk.text)
+                    yield chunk.text
+        # Usage metadata arrives with the final chunk
+        tracing.record_usage(chunk, prompt, "".join(text))
+
+    def stream_output(self, requirements: Dict) -> Iterator[Tuple[str, str]]:
+        """Yield ("questions" | "answers", text chunk) pairs as the paper is generated"""
+        if not self.model:
+            raise RuntimeError("Could not load the AI model. Please check your API key.")
+
+        separator = "=" * 50
+        cache_key = make_cache_key(requirements, MODEL_NAME)
+        cached_response = self.rate_limiter.get_cached_response(cache_key)
+        if cached_response:
+            questions, _, answers = cached_response.partition("\n\nAnswer Key\n" + separator + "\n\n")
+            yield "questions", questions.replace("Question Paper\n" + separator + "\n\n", "", 1)
+            if answers:
+                yield "answers", answers
+            return
+
+        questions = []
+        for chunk in self._stream_text(self.format_question_prompt(requirements)):
+            questions.append(chunk)
+            yield "questions", chunk
+        questions = "".join(questions).strip()
+
+        # The answer key request starts as soon as the last question chunk is shown
+        answers = []
+        for chunk in self._stream_text(self.format_answer_prompt(questions)):
+            answers.append(chunk)
+            yield "answers", chunk
+        answers = "".join(answers).strip()
 
-            # Check rate limiting
-            if not self.rate_limiter.can_make_call():
-                time.sleep(2)  # Wait if rate limit reached
+        complete_output = "Question Paper\n" + separator + "\n\n" + questions + "\n\nAnswer Key\n" + separator + "\n\n" + answers
+        self.rate_limiter.cache_response(cache_key, complete_output)
 
-            # Generate all questions in one go
+    def _generate_output(self, requirements: Dict, cache_key: str) -> Tuple[str, bool]:
+        # Generate all questions in one go
+        with tracing.span("prompt.build", kind="questions"):
             questions_prompt = self.format_question_prompt(requirements)
+        if not self.rate_limiter.acquire():
+            return "Error: API rate limit reached. Please try again in a minute.", False
+        with tracing.span("model.generate", kind="questions"):
             questions_response = self.model.generate_content(questions_prompt)
-            self.rate_limiter.log_call()
-            
-            questions = questions_response.text.strip()
 
-            # Generate all answers in one go
+        questions = questions_response.text.strip()
+        tracing.record_usage(questions_response, questions_prompt, questions)
+
+        # Generate all answers in one go
+        with tracing.span("prompt.build", kind="answers"):
             answers_prompt = self.format_answer_prompt(questions)
+        if not self.rate_limiter.acquire():
+            return "Error: API rate limit reached. Please try again in a minute.", False
+        with tracing.span("model.generate", kind="answers"):
             answers_response = self.model.generate_content(answers_prompt)
-            self.rate_limiter.log_call()
-            
-            answers = answers_response.text.strip()
 
-            # Combine output
-            separator = "=" * 50
-            complete_output = "Question Paper\n" + separator + "\n\n" + questions + "\n\nAnswer Key\n" + separator + "\n\n" + answers
+        answers = answers_response.text.strip()
+        tracing.record_usage(answers_response, answers_prompt, answers)
+
+        # Combine output
+        separator = "=" * 50
+        complete_output = "Question Paper\n" + separator + "\n\n" + questions + "\n\nAnswer Key\n" + separator + "\n\n" + answers
 
-            # Cache the result
-            self.rate_limiter.cache_response(cache_key, complete_output)
+        # Cache the result
+        self.rate_limiter.cache_response(cache_key, complete_output)
+
+        return complete_output, True
+
+    def get_output(self, requirements: Dict, parallel: bool = False) -> Tuple[str, bool]:
+        with tracing.trace("generate", mode="parallel" if parallel else "standard",
+                           subject=requirements.get("subject", "")):
+            return self._get_output(requirements, parallel)
+
+    def _get_output(self, requirements: Dict, parallel: bool) -> Tuple[str, bool]:
+        if parallel:
+            return self.get_output_parallel(requirements)
+
+        if not self.model:
+            return "Error: Could not load the AI model. Please check your API key.", False
+        
+        try:
+            # Check cache first
+            cache_key = make_cache_key(requirements, MODEL_NAME)
+            cached_response = self.rate_limiter.get_cached_response(cache_key)
+            if cached_response:
+                return cached_response, True
+
+            # Identical requests from other sessions wait for this one instead of calling Gemini again
+            return flights.do(cache_key, lambda: self._generate_output(requirements, cache_key))
 
-            return complete_output, True
-                        
         except Exception as e:
             return f"Error generating content: {str(e)}", False
 
-# Create a singleton instance
-generator = QuestionPaperGenerator()
+@st.cache_resource(show_spinner=False)
+def get_generator() -> QuestionPaperGenerator:
+    """The process-wide generator, created on first use so importing this module stays cheap"""
+    return QuestionPaperGenerator()
 
-def get_output(requirements: Dict) -> str:
-    output, success = generator.get_output(requirements)
+def get_output(requirements: Dict, parallel: bool = False) -> str:
+    output, success = get_generator().get_output(requirements, parallel=parallel)
     return output
+
+def stream_output(requirements: Dict) -> Iterator[Tuple[str, str]]:
+    return get_generator().stream_output(requirements)
+
+def syllabus_report(requirements: Dict, parallel: bool = False) -> Dict:
+    return get_generator().syllabus_report(requirements, parallel=parallel)
+
+def generate_paper(requirements: Dict) -> Paper:
+    return get_generator().generate_paper(requirements)
+
+def coalescing_stats() -> Dict:
+    return flights.stats()
@@ -0,0 +1,218 @@
+"""Model backends: Gemini, or a local fake that replays recorded papers.
+
+Pick one with the PAPER_MODEL_BACKEND environment variable ("gemini" or
+"fake") or pass a model straight to QuestionPaperGenerator. The fake's
+latency, jitter and error rate come from PAPER_FAKE_LATENCY,
+PAPER_FAKE_JITTER and PAPER_FAKE_ERROR_RATE.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from paper_model import parse_paper
+from syllabus_index import estimate_tokens
+
+DEFAULT_BACKEND = "gemini"
+
+# Used when there is no recorded history to replay
+SAMPLE_PAPER = {
+    'questions': """Section A: Multiple Choice Questions
+1. Which data structure follows the LIFO principle? (a) Queue (b) Stack (c) Heap (d) Tree
+2. What is the worst-case time complexity of binary search? (a) O(1) (b) O(n) (c) O(log n) (d) O(n log n)
+Section B: Short Answer Questions
+1. Explain the difference between a process and a thread. [3 Marks]
+2. Describe how a hash table resolves collisions. [3 Marks]
+Section C: Long Answer Questions
+1. Compare merge sort and quick sort with examples of when each is preferred. [5 Marks]
+2. Explain normalization up to BCNF with a worked example. [5 Marks]""",
+    'answers': """Answer Key
+Section A: Multiple Choice Questions
+1. (b) Stack - the last element pushed is the first popped.
+2. (c) O(log n) - the search space halves each step.
+Section B: Short Answer Questions
+1. A process has its own address space; threads share the address space of their process.
+2. By chaining entries in per-bucket lists or by probing for the next free slot.
+Section C: Long Answer Questions
+1. Merge sort is stable and O(n log n) in the worst case; quick sort is in-place and faster on average.
+2. Each normal form removes a class of dependency anomalies; BCNF requires every determinant to be a key."""
+}
+
+
+# The banner app-saved papers carry, which a model reply never starts with
+PAPER_HEADER = re.compile(r"^\s*(?:Question Paper|Answer Key)\s*=*\s*", re.IGNORECASE)
+
+
+class FakeBackendError(RuntimeError):
+    pass
+
+
+class _Usage:
+    __slots__ = ("prompt_token_count", "candidates_token_count")
+
+    def __init__(self, prompt_tokens: int, response_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+
+
+class FakeResponse:
+    """The parts of a Gemini response the app reads"""
+
+    def __init__(self, text: str, prompt: str = ""):
+        self.text = text
+        self.parts = [text] if text else []
+        self.usage_metadata = _Usage(estimate_tokens(prompt), estimate_tokens(text))
+
+
+class FakeGenerativeModel:
+    """Deterministic stand-in for genai.GenerativeModel.
+
+    Replies are replayed from recorded papers (paper_history.json by default)
+    and chosen by a hash of the prompt, so the same prompt always gets the
+    same reply. The reply's shape follows the prompt: whole papers, answer
+    keys, per-section JSON, batched or single answers.
+    """
+
+    def __init__(self, history_file: str = "paper_history.json", latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0, chunk_size: int = 200):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.calls = 0
+        self._load(history_file)
+
+    @staticmethod
+    def _replayable(record: Dict) -> Optional[Dict]:
+        """A recorded paper as a model would have written it, or None for failed generations"""
+        questions = record.get('questions') or ""
+        if not questions or questions.startswith("Error"):
+            return None
+        answers = record.get('answers') or ""
+        if answers.startswith("Error"):
+            answers = ""
+        return {
+            'questions': PAPER_HEADER.sub("", questions, count=1),
+            'answers': PAPER_HEADER.sub("", answers, count=1),
+        }
+
+    def _load(self, history_file: str):
+        records = []
+        if history_file and os.path.exists(history_file):
+            with open(history_file, 'r') as f:
+                history = json.load(f)
+            records = history if isinstance(history, list) else list(history.values())
+        papers = [p for p in map(self._replayable, records) if p]
+        papers = papers or [self._replayable(SAMPLE_PAPER)]
+        self.papers = papers
+        self.questions: Dict[str, List[Dict]] = {"MCQ": [], "descriptive_3": [], "descriptive_5": []}
+        self.answers: List[str] = []
+        for paper in papers:
+            parsed = parse_paper(paper['questions'] + "\n\nAnswer Key\n" + paper['answers'])
+            for section in parsed.sections:
+                for q in section.questions:
+                    if q.text:
+                        self.questions.setdefault(section.kind, []).append(
+                            {'text': q.text, 'options': q.options, 'marks': q.marks}
+                        )
+                    if q.answer:
+                        self.answers.append(q.answer)
+        self.answers = self.answers or ["See the textbook chapter on this topic."]
+
+    def _pick(self, items: List, prompt: str, offset: int = 0):
+        digest = int(hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).hexdigest()[:12], 16)
+        return items[(digest + offset) % len(items)]
+
+    def _delay(self) -> Tuple[float, bool]:
+        with self._random_lock:
+            self.calls += 1
+            fail = self._random.random() < self.error_rate
+            delay = self.latency + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        return max(0.0, delay), fail
+
+    def respond(self, prompt: str, json_mode: bool = False) -> str:
+        """The reply text for prompt, without latency or errors"""
+        if json_mode and '"answers"' in prompt:
+            count = len(re.findall(r"^\s*\*\*(\d+)\.\*\*", prompt, re.MULTILINE)) or 1
+            return json.dumps({"answers": [
+                {"number": n, "answer": self._pick(self.answers, prompt, n)} for n in range(1, count + 1)
+            ]})
+        if json_mode:
+            match = re.search(r"Write exactly (\d+) questions", prompt)
+            count = int(match[1]) if match else 1
+            if "Multiple Choice" in prompt:
+                pool = self.questions["MCQ"]
+            elif "Short Answer" in prompt:
+                pool = self.questions["descriptive_3"]
+            else:
+                pool = self.questions["descriptive_5"]
+            pool = pool or [q for qs in self.questions.values() for q in qs]
+            return json.dumps({"questions": [self._pick(pool, prompt, n) for n in range(count)]})
+
+        paper = self._pick(self.papers, prompt)
+        if "Generate a detailed answer key" in prompt:
+            return paper.get('answers') or ""
+        if "Answer each of the following" in prompt:
+            count = int(re.search(r"following (\d+) questions", prompt)[1])
+            return "\n\n".join(
+                f"### Answer {n}\n{self._pick(self.answers, prompt, n)}" for n in range(1, count + 1)
+            )
+        if prompt.lstrip().startswith("For this"):
+            return self._pick(self.answers, prompt)
+        return paper['questions']
+
+    def _chunks(self, text: str, prompt: str, delay: float) -> Iterator[FakeResponse]:
+        pieces = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        for piece in pieces:
+            time.sleep(delay / len(pieces))
+            yield FakeResponse(piece, prompt)
+
+    def generate_content(self, prompt: str, generation_config: Optional[Dict] = None, stream: bool = False):
+        delay, fail = self._delay()
+        json_mode = (generation_config or {}).get("response_mime_type") == "application/json"
+        text = self.respond(prompt, json_mode)
+        if stream:
+            if fail:
+                raise FakeBackendError("Injected fake backend error")
+            return self._chunks(text, prompt, delay)
+        time.sleep(delay)
+        if fail:
+            raise FakeBackendError("Injected fake backend error")
+        return FakeResponse(text, prompt)
+
+    async def generate_content_async(self, prompt: str, generation_config: Optional[Dict] = None):
+        delay, fail = self._delay()
+        await asyncio.sleep(delay)
+        if fail:
+            raise FakeBackendError("Injected fake backend error")
+        json_mode = (generation_config or {}).get("response_mime_type") == "application/json"
+        return FakeResponse(self.respond(prompt, json_mode), prompt)
+
+
+def create_model(model_name: str, backend: Optional[str] = None):
+    """Build the configured model backend"""
+    backend = backend or os.environ.get("PAPER_MODEL_BACKEND", DEFAULT_BACKEND)
+    if backend == "fake":
+        return FakeGenerativeModel(
+            latency=float(os.environ.get("PAPER_FAKE_LATENCY", "0")),
+            jitter=float(os.environ.get("PAPER_FAKE_JITTER", "0")),
+            error_rate=float(os.environ.get("PAPER_FAKE_ERROR_RATE", "0"))
+        )
+    if backend != "gemini":
+        raise ValueError(f"Unknown model backend: {backend}")
+
+    # Only the real backend needs the SDK and an API key
+    import google.generativeai as genai
+
+    with open("api_key.txt", "r") as f:
+        api_key = f.read()
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
@@ -0,0 +1,92 @@
+import streamlit as st
+from datetime import datetime
+import tracing
+from model import coalescing_stats, get_generator
+
+def render_admin_page():
+    import pandas as pd
+    import plotly.express as px
+
+    st.title("Generation Metrics")
+
+    # Sidebar controls
+    st.sidebar.header("Tracing")
+    limit = st.sidebar.slider("Traces to analyse", min_value=50, max_value=2000, value=500, step=50)
+    tracing.settings['profile'] = st.sidebar.checkbox(
+        "cProfile each request", value=tracing.settings['profile'],
+        help="Adds the 25 most expensive functions to each trace; slows requests down"
+    )
+    tracing.settings['memory'] = st.sidebar.checkbox(
+        "tracemalloc each request", value=tracing.settings['memory'],
+        help="Records peak memory and the top allocation sites; slows requests down"
+    )
+    st.sidebar.caption(f"Metrics file: {tracing.METRICS_FILE}")
+
+    records = tracing.load_records(limit)
+    summary = tracing.summarize(records)
+    counters = summary['counters']
+    generations = [r for r in records if r['name'] in ("generate", "job", "batch_job")]
+
+    # Headline numbers
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Traces", summary['traces'], help=f"{summary['errors']} with errors")
+    with col2:
+        durations = [r['duration_ms'] / 1000 for r in generations]
+        st.metric("Generation p50 / p95",
+                  f"{tracing._percentile(durations, 0.5):.1f}s / {tracing._percentile(durations, 0.95):.1f}s")
+    with col3:
+        lookups = counters.get('cache_hits', 0) + counters.get('cache_misses', 0)
+        st.metric("Cache hit rate", f"{counters.get('cache_hits', 0) / lookups:.0%}" if lookups else "—")
+    with col4:
+        st.metric("Rate-limit wait", f"{counters.get('limiter_wait_ms', 0) / 1000:.1f}s")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Model calls", int(counters.get('model_calls', 0)))
+    with col2:
+        st.metric("Prompt tokens", f"{int(counters.get('prompt_tokens', 0)):,}")
+    with col3:
+        st.metric("Response tokens", f"{int(counters.get('response_tokens', 0)):,}")
+    with col4:
+        flights = coalescing_stats()
+        st.metric("Calls saved by coalescing", flights['saved'], help=f"{flights['executed']} calls made")
+
+    if not records:
+        st.info("No traces recorded yet. Generate a paper to see where the time goes.")
+        return
+
+    # Latency breakdown per span
+    st.subheader("Latency breakdown")
+    spans = pd.DataFrame([
+        {'span': name, **values} for name, values in summary['spans'].items()
+    ]).sort_values('total_ms', ascending=False)
+    fig = px.bar(spans, x='span', y=['p50_ms', 'p95_ms'], barmode='group',
+                 labels={'value': 'milliseconds', 'variable': ''})
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(spans, hide_index=True, use_container_width=True)
+
+    with st.expander("Response cache"):
+        st.json(get_generator().rate_limiter.cache.stats())
+
+    # Most recent traces, newest first
+    st.subheader("Recent traces")
+    for record in reversed(records[-20:]):
+        started = datetime.fromtimestamp(record['started']).strftime("%Y-%m-%d %H:%M:%S")
+        label = f"{record['name']} · {record['duration_ms'] / 1000:.2f}s · {started}"
+        if record.get('error'):
+            label += " · ⚠️"
+        with st.expander(label):
+            if record.get('error'):
+                st.error(record['error'])
+            st.write({**record.get('attrs', {}), **record.get('counters', {})})
+            if record.get('spans'):
+                st.dataframe(pd.DataFrame(record['spans']), hide_index=True, use_container_width=True)
+            if record.get('memory'):
+                st.markdown(f"**Peak memory:** {record['memory']['peak_kb']:,} KB")
+                st.code("\n".join(record['memory']['top']))
+            if record.get('profile'):
+                st.code(record['profile'])
+
+if __name__ == "__main__":
+    render_admin_page()
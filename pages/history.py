@@ -1,18 +1,83 @@
 import streamlit as st
-from history_manager import HistoryManager
-import plotly.express as px
-import pandas as pd
+from shared_resources import get_history_manager
+from pdf_export import pdf_download_button
+from paper_model import Paper
 from datetime import datetime
 
+def render_statistics_charts(history_manager, stats):
+    import pandas as pd
+    import plotly.express as px
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        # Create pie chart for subjects
+        if stats['papers_by_subject']:
+            df_subjects = pd.DataFrame({
+                'Subject': list(stats['papers_by_subject'].keys()),
+                'Count': list(stats['papers_by_subject'].values())
+            })
+            fig_subjects = px.pie(
+                df_subjects,
+                values='Count',
+                names='Subject',
+                title="Papers by Subject"
+            )
+            st.plotly_chart(fig_subjects, use_container_width=True)
+        else:
+            st.info("No subject data available")
+    
+    with col2:
+        # Create bar chart for difficulty levels
+        if stats['papers_by_difficulty']:
+            df_difficulty = pd.DataFrame({
+                'Difficulty': list(stats['papers_by_difficulty'].keys()),
+                'Count': list(stats['papers_by_difficulty'].values())
+            })
+            fig_difficulty = px.bar(
+                df_difficulty,
+                x='Difficulty',
+                y='Count',
+                title="Papers by Difficulty",
+                color='Difficulty',
+                color_discrete_map={
+                    'Easy': '#2ecc71',
+                    'Medium': '#f1c40f',
+                    'Hard': '#e74c3c'
+                }
+            )
+            fig_difficulty.update_layout(
+                showlegend=False,
+                xaxis_title="",
+                yaxis_title="Number of Papers"
+            )
+            st.plotly_chart(fig_difficulty, use_container_width=True)
+        else:
+            st.info("No difficulty data available")
+    
+    # Papers over time, read from the per-day aggregates
+    period = st.radio("Papers per", ["day", "week"], horizontal=True, key="stats_period")
+    series = history_manager.get_papers_over_time(period)
+    if series:
+        df_series = pd.DataFrame(series)
+        fig_series = px.bar(
+            df_series,
+            x='date',
+            y='count',
+            title=f"Papers per {period.capitalize()}"
+        )
+        fig_series.update_layout(xaxis_title="", yaxis_title="Number of Papers")
+        st.plotly_chart(fig_series, use_container_width=True)
+
 def render_history_page():
     st.title("Question Paper History")
     
-    # Initialize history manager
-    history_manager = HistoryManager()
+    # Shared by every session, so reruns reuse its connection
+    history_manager = get_history_manager()
     
     # Sidebar filters
     st.sidebar.header("Filters")
-    search_query = st.sidebar.text_input("Search by subject/topic")
+    search_query = st.sidebar.text_input("Search subject, topic, questions or answers")
     date_range = st.sidebar.date_input(
         "Date Range",
         value=(datetime.now().date(), datetime.now().date())
@@ -23,78 +88,45 @@ def render_history_page():
     
     # Show statistics in expandable section
     with st.expander("📊 Statistics", expanded=True):
-        col1, col2, col3 = st.columns(3)
-        
+        col1, col2 = st.columns(2)
         with col1:
             st.metric("Total Papers", stats['total_papers'])
-            st.metric("Average Marks", f"{stats['average_marks']:.1f}")
-        
         with col2:
-            # Create pie chart for subjects
-            if stats['papers_by_subject']:
-                df_subjects = pd.DataFrame({
-                    'Subject': list(stats['papers_by_subject'].keys()),
-                    'Count': list(stats['papers_by_subject'].values())
-                })
-                fig_subjects = px.pie(
-                    df_subjects,
-                    values='Count',
-                    names='Subject',
-                    title="Papers by Subject"
-                )
-                st.plotly_chart(fig_subjects, use_container_width=True)
-            else:
-                st.info("No subject data available")
+            st.metric("Average Marks", f"{stats['average_marks']:.1f}")
         
-        with col3:
-            # Create bar chart for difficulty levels
-            if stats['papers_by_difficulty']:
-                df_difficulty = pd.DataFrame({
-                    'Difficulty': list(stats['papers_by_difficulty'].keys()),
-                    'Count': list(stats['papers_by_difficulty'].values())
-                })
-                fig_difficulty = px.bar(
-                    df_difficulty,
-                    x='Difficulty',
-                    y='Count',
-                    title="Papers by Difficulty",
-                    color='Difficulty',
-                    color_discrete_map={
-                        'Easy': '#2ecc71',
-                        'Medium': '#f1c40f',
-                        'Hard': '#e74c3c'
-                    }
-                )
-                fig_difficulty.update_layout(
-                    showlegend=False,
-                    xaxis_title="",
-                    yaxis_title="Number of Papers"
-                )
-                st.plotly_chart(fig_difficulty, use_container_width=True)
-            else:
-                st.info("No difficulty data available")
+        # The charts need pandas and plotly, which are slow to import, so they load on request
+        if st.toggle("Show charts", key="show_charts"):
+            render_statistics_charts(history_manager, stats)
     
-    # Get papers based on filters
-    if search_query:
-        papers = history_manager.search_papers(search_query)
+    # Fetch only the requested page of summaries; bodies load when a paper is opened
+    if len(date_range) == 2:
+        since, until = date_range
     else:
-        papers = history_manager.get_all_papers()
+        since = until = date_range[0] if date_range else None
     
-    # Filter by date range
-    papers = [
-        p for p in papers
-        if date_range[0] <= datetime.strptime(p['timestamp'].split()[0], "%Y-%m-%d").date() <= date_range[1]
-    ]
+    page_size = st.sidebar.selectbox("Papers per page", [10, 20, 50], index=1)
+    page = st.sidebar.number_input("Page", min_value=1, value=1, step=1)
+    # One call returns the page and the total; a page past the end comes back as the last page
+    result = history_manager.get_papers(
+        offset=(page - 1) * page_size, limit=page_size,
+        since=since, until=until, query=search_query or None
+    )
+    total = result['total']
+    num_pages = max(1, (total + page_size - 1) // page_size)
+    page = result['offset'] // page_size + 1
+    papers = result['papers']
     
     # Show papers
-    st.header(f"Generated Papers ({len(papers)})")
+    st.header(f"Generated Papers ({total})")
     
     if not papers:
         st.info("No papers found matching your criteria")
         return
     
-    for paper in papers:
-        with st.expander(f"Paper {paper['id']} - {paper['timestamp']}"):
+    st.caption(f"Page {page} of {num_pages}")
+    
+    for summary in papers:
+        with st.expander(f"Paper {summary['id']} - {summary['timestamp']}"):
             # Paper metadata
             st.markdown(f"""
                 <div style='background-color: #f8f9fa; padding: 1rem; border-radius: 5px; margin-bottom: 1rem;'>
@@ -103,20 +135,42 @@ def render_history_page():
                     <table style='width: 100%;'>
                         <tr>
                             <td><strong>Subject:</strong></td>
-                            <td>{paper['metadata'].get('subject', 'N/A')}</td>
+                            <td>{summary['metadata'].get('subject', 'N/A')}</td>
                             <td><strong>Topic:</strong></td>
-                            <td>{paper['metadata'].get('topic', 'N/A')}</td>
+                            <td>{summary['metadata'].get('topic', 'N/A')}</td>
                         </tr>
                         <tr>
                             <td><strong>Difficulty:</strong></td>
-                            <td>{paper['metadata'].get('difficulty', 'N/A')}</td>
+                            <td>{summary['metadata'].get('difficulty', 'N/A')}</td>
                             <td><strong>Total Marks:</strong></td>
-                            <td>{paper['metadata'].get('total_marks', 'N/A')}</td>
+                            <td>{summary['metadata'].get('total_marks', 'N/A')}</td>
                         </tr>
                     </table>
                 </div>
             """, unsafe_allow_html=True)
             
+            if summary['snippet']:
+                st.markdown(f"> {summary['snippet']}")
+            
+            # Streamlit runs expander bodies even when collapsed, so gate the heavy part
+            if not st.toggle("Show paper", key=f"open_{summary['id']}"):
+                continue
+            
+            paper = history_manager.get_paper(summary['id'])
+            if not paper:
+                st.warning("This paper is no longer available")
+                continue
+            # PDFs are built from the structure when the paper has one, else from the stored markdown
+            question_pdf, answer_pdf = paper['questions'], paper['answers']
+            if paper.get('paper'):
+                # Newer papers keep their parsed structure; render from that
+                structured = Paper.from_dict(paper['paper'])
+                paper['questions'] = structured.questions_markdown()
+                question_pdf = structured.questions_only()
+                if structured.has_answers:
+                    paper['answers'] = "Answer Key\n\n" + structured.answers_markdown()
+                    answer_pdf = structured.answers_only()
+            
             # Paper content in tabs
             tab1, tab2 = st.tabs(["📝 Question Paper", "✅ Answer Key"])
             
@@ -124,22 +178,20 @@ def render_history_page():
                 st.markdown(paper['questions'])
                 col1, col2 = st.columns([3, 1])
                 with col1:
-                    st.download_button(
+                    pdf_download_button(
                         "📄 Download Question Paper",
-                        paper['questions'],
+                        question_pdf,
                         f"question_paper_{paper['id']}.pdf",
-                        mime="application/pdf",
                         key=f"hist_q_{paper['id']}"
                     )
             
             if paper['answers']:
                 with tab2:
                     st.markdown(paper['answers'])
-                    st.download_button(
+                    pdf_download_button(
                         "✅ Download Answer Key",
-                        paper['answers'],
+                        answer_pdf,
                         f"answer_key_{paper['id']}.pdf",
-                        mime="application/pdf",
                         key=f"hist_a_{paper['id']}"
                     )
             
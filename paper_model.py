@@ -0,0 +1,341 @@
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# (section kind, marks per question, default title), in paper order
+SECTION_KINDS = [
+    ("MCQ", 1, "Section A: Multiple Choice Questions"),
+    ("descriptive_3", 3, "Section B: Short Answer Questions"),
+    ("descriptive_5", 5, "Section C: Long Answer Questions"),
+]
+
+NUMBERED_ITEM = re.compile(r"^\s*(?:[*#]+\s*)?(?:Q\.?\s*)?(\d+)\s*[.)]\s*(?:\*\*)?\s*(.*)$")
+SECTION_HEADING = re.compile(r"^\s*[#*\s]*((?:section|part)\s+[a-z0-9]\b.*?)[*\s]*$", re.IGNORECASE)
+ANSWER_KEY_MARKER = re.compile(r"^\s*[#*\s]*answer\s+key[*\s:=]*$", re.IGNORECASE)
+QUESTION_PAPER_MARKER = re.compile(r"^\s*[#*\s]*question\s+paper[*\s:=]*$", re.IGNORECASE)
+RULE = re.compile(r"^\s*[=\-_*]{3,}\s*$")
+OPTION = re.compile(r"(?:^|\s)\(?([a-dA-D])[).]\s+")
+MARKS = re.compile(r"\[\s*(\d+)\s*marks?\s*\]", re.IGNORECASE)
+
+
+@dataclass(slots=True)
+class Question:
+    number: int
+    text: str = ""
+    marks: int = 1
+    options: List[str] = field(default_factory=list)
+    answer: Optional[str] = None
+    # Row id in the question bank when the question was sampled from it; not serialized
+    bank_id: Optional[int] = None
+
+
+@dataclass(slots=True)
+class Section:
+    kind: str
+    title: str
+    marks: int
+    questions: List[Question] = field(default_factory=list)
+
+
+@dataclass(slots=True)
+class Paper:
+    title: str = ""
+    header: List[str] = field(default_factory=list)
+    sections: List[Section] = field(default_factory=list)
+
+    @property
+    def total_marks(self) -> int:
+        return sum(q.marks for s in self.sections for q in s.questions)
+
+    @property
+    def has_questions(self) -> bool:
+        return any(q.text for s in self.sections for q in s.questions)
+
+    @property
+    def has_answers(self) -> bool:
+        return any(q.answer for s in self.sections for q in s.questions)
+
+    def questions_markdown(self) -> str:
+        lines = []
+        if self.title:
+            lines.append(f"### {self.title}")
+        if self.header:
+            lines.append("  \n".join(self.header))
+        for section in self.sections:
+            lines.append(f"#### {section.title}")
+            for q in section.questions:
+                lines.append(f"**{q.number}.** {q.text} [{q.marks} Mark{'s' if q.marks != 1 else ''}]")
+                if q.options:
+                    lines.append("  \n".join(f"({chr(97 + i)}) {option}" for i, option in enumerate(q.options)))
+        return "\n\n".join(lines)
+
+    def answers_markdown(self) -> str:
+        lines = []
+        for section in self.sections:
+            lines.append(f"#### {section.title}")
+            lines.extend(f"**{q.number}.** {q.answer or '—'}" for q in section.questions)
+        return "\n\n".join(lines)
+
+    def to_text(self) -> str:
+        """The plain 'Question Paper ... Answer Key ...' layout used by the string API"""
+        separator = "=" * 50
+        text = "Question Paper\n" + separator + "\n\n" + self.questions_markdown()
+        if self.has_answers:
+            text += "\n\nAnswer Key\n" + separator + "\n\n" + self.answers_markdown()
+        return text
+
+    def questions_only(self) -> "Paper":
+        """A copy without answers, for the question paper PDF"""
+        data = self.to_dict()
+        for s in data['sections']:
+            for q in s['questions']:
+                q['answer'] = None
+        return Paper.from_dict(data)
+
+    def answers_only(self) -> "Paper":
+        """A copy with only the answer key, for the answer key PDF"""
+        data = self.to_dict()
+        for s in data['sections']:
+            for q in s['questions']:
+                q['text'], q['options'] = "", []
+        return Paper.from_dict(data)
+
+    def to_dict(self) -> Dict:
+        return {
+            'title': self.title,
+            'header': list(self.header),
+            'sections': [{
+                'kind': s.kind,
+                'title': s.title,
+                'marks': s.marks,
+                'questions': [{
+                    'number': q.number,
+                    'text': q.text,
+                    'marks': q.marks,
+                    'options': list(q.options),
+                    'answer': q.answer
+                } for q in s.questions]
+            } for s in self.sections]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Paper":
+        return cls(
+            title=data.get('title', ''),
+            header=list(data.get('header', [])),
+            sections=[Section(
+                kind=s['kind'],
+                title=s['title'],
+                marks=s['marks'],
+                questions=[Question(**q) for q in s.get('questions', [])]
+            ) for s in data.get('sections', [])]
+        )
+
+
+def section_kind(title: str, position: int) -> str:
+    """Guess a section's kind from its heading, falling back to its position"""
+    lowered = title.lower()
+    if "multiple choice" in lowered or "mcq" in lowered or "objective" in lowered:
+        return "MCQ"
+    if "short" in lowered or "3 mark" in lowered or "× 3" in lowered:
+        return "descriptive_3"
+    if "long" in lowered or "5 mark" in lowered or "× 5" in lowered:
+        return "descriptive_5"
+    return SECTION_KINDS[min(position, len(SECTION_KINDS) - 1)][0]
+
+
+def new_section(kind: str, title: Optional[str] = None) -> Section:
+    _, marks, default_title = next(k for k in SECTION_KINDS if k[0] == kind)
+    return Section(kind=kind, title=title or default_title, marks=marks)
+
+
+def split_options(text: str):
+    """Split '(a) x (b) y' style option runs off a line; returns (prefix, options)"""
+    matches = list(OPTION.finditer(text))
+    letters = [m.group(1).lower() for m in matches]
+    if len(matches) < 2 or letters[:2] != ["a", "b"]:
+        if len(matches) == 1 and matches[0].start() == 0:
+            return "", [text[matches[0].end():].strip()]
+        return text, []
+    options = [
+        text[m.end():(matches[i + 1].start() if i + 1 < len(matches) else len(text))].strip()
+        for i, m in enumerate(matches)
+    ]
+    return text[:matches[0].start()].strip(), options
+
+
+def _clean(text: str) -> str:
+    return text.replace("**", "").strip()
+
+
+def parse_paper(text: str) -> Paper:
+    """Parse generated text into a Paper in a single pass over its lines.
+
+    Handles the question paper, the answer key, or both: after an 'Answer Key'
+    line, sections and numbered items are matched to the questions already
+    seen (by section order and number) and become their answers.
+    """
+    paper = Paper()
+    answer_mode = False
+    section = None
+    question = None
+    answer_section_index = -1
+    answer_target = None
+    answer_lines = []
+
+    def flush_answer():
+        nonlocal answer_lines
+        if answer_target is not None and answer_lines:
+            answer_target.answer = _clean("\n".join(answer_lines))
+        answer_lines = []
+
+    for raw in text.splitlines():
+        line = raw.rstrip()
+        if not line.strip() or RULE.match(line):
+            continue
+        if QUESTION_PAPER_MARKER.match(line):
+            continue
+        if ANSWER_KEY_MARKER.match(line):
+            answer_mode = True
+            question = None
+            continue
+
+        heading = SECTION_HEADING.match(line)
+        if heading:
+            title = _clean(heading.group(1))
+            if not answer_mode:
+                section = new_section(section_kind(title, len(paper.sections)), title)
+                paper.sections.append(section)
+                question = None
+            else:
+                flush_answer()
+                answer_target = None
+                answer_section_index += 1
+                if answer_section_index >= len(paper.sections):
+                    paper.sections.append(new_section(section_kind(title, answer_section_index), title))
+            continue
+
+        item = NUMBERED_ITEM.match(line)
+        # Indented numbered lines, or ones that break the running sequence, are sub-steps
+        previous = answer_target if answer_mode else question
+        if item and (len(line) - len(line.lstrip()) >= 4 or
+                     (previous is not None and int(item.group(1)) != previous.number + 1)):
+            item = None
+
+        if answer_mode:
+            if item:
+                flush_answer()
+                number = int(item.group(1))
+                answer_section_index = max(answer_section_index, 0)
+                if answer_section_index >= len(paper.sections):
+                    paper.sections.append(new_section(SECTION_KINDS[min(answer_section_index, 2)][0]))
+                target_section = paper.sections[answer_section_index]
+                answer_target = next((q for q in target_section.questions if q.number == number), None)
+                if answer_target is None:
+                    answer_target = Question(number=number, marks=target_section.marks)
+                    target_section.questions.append(answer_target)
+                answer_lines = [item.group(2)]
+            elif answer_target is not None:
+                answer_lines.append(line.strip())
+            continue
+
+        if section is None:
+            # Everything before the first section is the exam header
+            cleaned = _clean(line).lstrip("#").strip()
+            if not paper.title and not paper.header:
+                paper.title = cleaned
+            else:
+                paper.header.append(cleaned)
+            continue
+
+        if item:
+            body = item.group(2)
+            question = Question(number=int(item.group(1)), marks=section.marks)
+            section.questions.append(question)
+        elif question is None:
+            continue
+        else:
+            body = line.strip()
+
+        marks = MARKS.search(body)
+        if marks:
+            question.marks = int(marks.group(1))
+            body = MARKS.sub("", body).strip()
+        if section.kind == "MCQ":
+            body, options = split_options(body)
+            question.options.extend(_clean(option) for option in options)
+        if body:
+            question.text = _clean(f"{question.text}\n{body}" if question.text else body)
+
+    flush_answer()
+    return paper
+
+
+def _repair_json(raw: str):
+    """Best-effort cleanup of model JSON: code fences, leading prose, trailing commas"""
+    text = raw.strip()
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if starts:
+        start = min(starts)
+        end = max(text.rfind("}"), text.rfind("]"))
+        text = text[start:end + 1]
+    text = re.sub(r",\s*([}\]])", r"\1", text)
+    return json.loads(text)
+
+
+def questions_from_json(raw: str, kind: str) -> List[Question]:
+    """Validate a {"questions": [{"text", "options", "marks"}]} reply.
+
+    Accepts a bare list and plain strings, fills in numbering and marks and
+    splits options out of the text when the model inlined them. Raises
+    ValueError when nothing usable can be recovered.
+    """
+    try:
+        data = _repair_json(raw)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON from model: {e}")
+    items = data.get("questions", []) if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError("Expected a list of questions")
+
+    _, marks, _ = next(k for k in SECTION_KINDS if k[0] == kind)
+    questions = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"text": item}
+        if not isinstance(item, dict) or not str(item.get("text") or item.get("question") or "").strip():
+            continue
+        text = str(item.get("text") or item.get("question")).strip()
+        options = [str(option).strip() for option in item.get("options") or [] if str(option).strip()]
+        if kind == "MCQ" and not options:
+            text, options = split_options(text)
+        # Drop letter prefixes the model sometimes keeps on options
+        options = [re.sub(r"^\(?[a-dA-D][).]\s*", "", option) for option in options]
+        try:
+            question_marks = int(item.get("marks") or marks)
+        except (TypeError, ValueError):
+            question_marks = marks
+        questions.append(Question(number=len(questions) + 1, text=text, marks=question_marks, options=options))
+    if not questions:
+        raise ValueError("No questions found in model output")
+    return questions
+
+
+def answers_from_json(raw: str) -> Dict[int, str]:
+    """Validate a {"answers": [{"number", "answer"}]} reply into number -> answer"""
+    data = _repair_json(raw)
+    items = data.get("answers", []) if isinstance(data, dict) else data
+    answers = {}
+    for position, item in enumerate(items if isinstance(items, list) else [], 1):
+        if isinstance(item, str):
+            item = {"answer": item}
+        if not isinstance(item, dict) or not str(item.get("answer") or "").strip():
+            continue
+        try:
+            number = int(item.get("number") or position)
+        except (TypeError, ValueError):
+            number = position
+        answers[number] = str(item["answer"]).strip()
+    return answers
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Optional, Union
+
+import streamlit as st
+from xml.sax.saxutils import escape
+
+from paper_model import Paper, parse_paper
+from storage import atomic_write
+import tracing
+
+
+@st.cache_resource(show_spinner=False)
+def pdf_styles() -> Dict:
+    """Paragraph styles, built once per process on the first PDF so ReportLab stays out of startup"""
+    from reportlab.lib.colors import HexColor
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    styles = getSampleStyleSheet()
+    return {
+        'Normal': styles['Normal'],
+        'Title': ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=16,
+            spaceAfter=30,
+            alignment=1,
+            textColor=HexColor('#2c3e50'),
+            fontName='Helvetica-Bold'
+        ),
+        'Header': ParagraphStyle(
+            'CustomHeader',
+            parent=styles['Normal'],
+            fontSize=12,
+            spaceAfter=20,
+            alignment=1,
+            textColor=HexColor('#34495e'),
+            fontName='Helvetica'
+        ),
+        'Section': ParagraphStyle(
+            'CustomSection',
+            parent=styles['Heading2'],
+            fontSize=14,
+            spaceBefore=20,
+            spaceAfter=20,
+            textColor=HexColor('#2c3e50'),
+            fontName='Helvetica-Bold'
+        ),
+        'Question': ParagraphStyle(
+            'CustomQuestion',
+            parent=styles['Normal'],
+            fontSize=12,
+            leading=16,
+            spaceBefore=12,
+            spaceAfter=12,
+            leftIndent=20,
+            fontName='Times-Roman'
+        ),
+        'Option': ParagraphStyle(
+            'CustomOption',
+            parent=styles['Normal'],
+            fontSize=12,
+            leading=14,
+            leftIndent=40,
+            spaceBefore=2,
+            spaceAfter=2,
+            fontName='Times-Roman'
+        ),
+        'Answer': ParagraphStyle(
+            'CustomAnswer',
+            parent=styles['Normal'],
+            fontSize=12,
+            leading=16,
+            leftIndent=40,
+            spaceBefore=6,
+            spaceAfter=12,
+            fontName='Times-Roman'
+        )
+    }
+
+
+def _markup(text: str) -> str:
+    """Escape text for ReportLab paragraphs, keeping **bold** and line breaks"""
+    text = escape(text)
+    text = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', text)
+    return text.replace('\n', '<br/>')
+
+
+def build_story(paper: Paper):
+    """Lay out a parsed paper: question paper first, then the answer key"""
+    from reportlab.platypus import Paragraph, PageBreak
+
+    custom_styles = pdf_styles()
+    story = []
+    if paper.has_questions:
+        story.append(Paragraph("Question Paper", custom_styles['Title']))
+        if paper.title:
+            story.append(Paragraph(_markup(paper.title), custom_styles['Header']))
+        for line in paper.header:
+            story.append(Paragraph(_markup(line), custom_styles['Header']))
+        for section in paper.sections:
+            story.append(Paragraph(_markup(section.title), custom_styles['Section']))
+            for q in section.questions:
+                story.append(Paragraph(
+                    f"{q.number}. {_markup(q.text)} [{q.marks} Mark{'s' if q.marks != 1 else ''}]",
+                    custom_styles['Question']
+                ))
+                for i, option in enumerate(q.options):
+                    story.append(Paragraph(f"({chr(97 + i)}) {_markup(option)}", custom_styles['Option']))
+
+    if paper.has_answers:
+        if story:
+            story.append(PageBreak())
+        story.append(Paragraph("Answer Key", custom_styles['Title']))
+        for section in paper.sections:
+            story.append(Paragraph(_markup(section.title), custom_styles['Section']))
+            for q in section.questions:
+                if q.answer:
+                    story.append(Paragraph(f"{q.number}. {_markup(q.answer)}", custom_styles['Answer']))
+    return story
+
+
+def convert_to_pdf(content: Union[str, Paper]):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=letter,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=72,
+        bottomMargin=72
+    )
+
+    # A Paper is laid out as is; markdown (e.g. papers saved before they were structured) is parsed first
+    with tracing.span("pdf.parse"):
+        paper = content if isinstance(content, Paper) else parse_paper(content)
+        story = build_story(paper)
+
+    try:
+        if not story:
+            raise ValueError("no questions or answers found")
+        with tracing.span("pdf.build"):
+            doc.build(story)
+    except Exception as e:
+        st.error(f"Error building PDF: {str(e)}")
+        # Fallback to simpler formatting
+        text = content if isinstance(content, str) else paper.to_text()
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=letter)
+        story = [Paragraph(_markup(line), pdf_styles()['Normal']) for line in text.split('\n') if line.strip()]
+        doc.build(story)
+
+    buffer.seek(0)
+    return buffer
+
+
+class PDFCache:
+    """LRU cache of rendered PDFs keyed by a hash of their source: a Paper's dict or markdown text.
+
+    Entries evicted from memory are spilled to spill_dir (when given) so a
+    later request can still skip the ReportLab build. The spill directory is
+    kept under max_spill_bytes by deleting the least recently used files.
+    """
+
+    def __init__(self, max_items: int = 64, spill_dir: Optional[str] = None,
+                 max_spill_bytes: int = 256 * 1024 * 1024):
+        self.max_items = max_items
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(content: Union[str, Paper]) -> str:
+        if isinstance(content, Paper):
+            content = json.dumps(content.to_dict(), sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _spill_path(self, key: str) -> str:
+        return os.path.join(self.spill_dir, f"{key}.pdf")
+
+    def get(self, content: Union[str, Paper]) -> Optional[bytes]:
+        key = self.key(content)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        if self.spill_dir:
+            try:
+                with open(self._spill_path(key), "rb") as f:
+                    data = f.read()
+                # Reads refresh the mtime, which is what pruning orders by
+                os.utime(self._spill_path(key))
+            except FileNotFoundError:
+                return None
+            self._put(key, data)
+            return data
+        return None
+
+    def _put(self, key: str, data: bytes):
+        evicted = []
+        with self._lock:
+            self._items[key] = data
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                evicted.append(self._items.popitem(last=False))
+        if self.spill_dir and evicted:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            for old_key, old_data in evicted:
+                if not os.path.exists(self._spill_path(old_key)):
+                    # Other app processes may read the spill directory at any moment
+                    atomic_write(self._spill_path(old_key), old_data)
+            self._prune_spill()
+
+    def _prune_spill(self):
+        """Delete the least recently used spilled PDFs until the directory fits max_spill_bytes"""
+        files = []
+        for entry in os.scandir(self.spill_dir):
+            if entry.name.endswith(".pdf"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_spill_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass  # another process pruned it first
+            total -= size
+
+    def get_or_render(self, content: Union[str, Paper]) -> bytes:
+        """Return the PDF for content, rendering it only on a cache miss"""
+        data = self.get(content)
+        if data is None:
+            size = ({"questions": sum(len(s.questions) for s in content.sections)} if isinstance(content, Paper)
+                    else {"chars": len(content)})
+            with tracing.trace("pdf", **size):
+                data = convert_to_pdf(content).getvalue()
+            self._put(self.key(content), data)
+        return data
+
+    def contains(self, content: Union[str, Paper]) -> bool:
+        key = self.key(content)
+        with self._lock:
+            if key in self._items:
+                return True
+        return bool(self.spill_dir) and os.path.exists(self._spill_path(key))
+
+
+pdf_cache = PDFCache(spill_dir=".pdf_cache")
+
+
+def get_pdf_bytes(content: Union[str, Paper]) -> bytes:
+    return pdf_cache.get_or_render(content)
+
+
+def pdf_download_button(label: str, content: Union[str, Paper], file_name: str, key: str):
+    """Offer a PDF download, building the PDF only after the user asks for it"""
+    prepared_key = f"{key}_prepared_{pdf_cache.key(content)[:16]}"
+    if st.session_state.get(prepared_key) or pdf_cache.contains(content):
+        st.download_button(
+            label,
+            get_pdf_bytes(content),
+            file_name,
+            mime="application/pdf",
+            key=key
+        )
+    elif st.button(f"{label} (prepare PDF)", key=f"{key}_prepare"):
+        st.session_state[prepared_key] = True
+        st.rerun()
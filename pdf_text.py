@@ -0,0 +1,134 @@
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import TYPE_CHECKING, Iterator, List, Tuple
+
+if TYPE_CHECKING:
+    from PyPDF2 import PdfReader
+
+MAX_PAGES = 300
+MAX_BYTES = 20 * 1024 * 1024
+# Below this many pages a process pool costs more than it saves
+PARALLEL_PAGE_THRESHOLD = 40
+
+
+def clean_page_text(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def iter_page_text(reader: "PdfReader", start: int = 0, stop: int = None) -> Iterator[str]:
+    """Yield the cleaned text of each non-empty page in [start, stop)"""
+    stop = len(reader.pages) if stop is None else stop
+    for index in range(start, stop):
+        text = clean_page_text(reader.pages[index].extract_text() or "")
+        if text:
+            yield text
+
+
+def open_pdf(data: bytes) -> "PdfReader":
+    # PyPDF2 is imported on the first upload rather than at app startup
+    from PyPDF2 import PdfReader
+
+    return PdfReader(BytesIO(data))
+
+
+def _extract_page_range(data: bytes, start: int, stop: int) -> List[str]:
+    # Runs in a worker process, so it parses its own copy of the document
+    return list(iter_page_text(open_pdf(data), start, stop))
+
+
+class _ExtractionCache:
+    """Small LRU of extracted text keyed by the upload's content hash"""
+
+    def __init__(self, max_items: int = 16):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        return None
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+_cache = _ExtractionCache()
+
+POOL_WORKERS = min(4, os.cpu_count() or 1)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """One bounded extraction pool per process, started on the first large upload.
+
+    Workers come from a forkserver (or spawn) rather than fork: the Streamlit
+    server is multi-threaded, and a forked child could inherit a lock held by
+    another thread and hang.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+
+
+def extract_text(data: bytes, max_pages: int = MAX_PAGES, max_bytes: int = MAX_BYTES,
+                 workers: int = None) -> Tuple[str, int, int]:
+    """Extract cleaned text from PDF bytes.
+
+    Returns (text, pages_read, total_pages); only the first max_pages pages are
+    read. Large documents are split into page ranges across a process pool.
+    Raises ValueError if the upload is larger than max_bytes.
+    """
+    if len(data) > max_bytes:
+        raise ValueError(f"PDF is larger than the {max_bytes // (1024 * 1024)} MB limit")
+
+    key = hashlib.sha256(data).hexdigest() + f":{max_pages}"
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    reader = open_pdf(data)
+    total_pages = len(reader.pages)
+    pages_read = min(total_pages, max_pages)
+
+    workers = workers or POOL_WORKERS
+    if pages_read >= PARALLEL_PAGE_THRESHOLD and workers > 1:
+        step = -(-pages_read // workers)
+        ranges = [(start, min(start + step, pages_read)) for start in range(0, pages_read, step)]
+        executor = _get_pool()
+        try:
+            futures = [executor.submit(_extract_page_range, data, start, stop) for start, stop in ranges]
+            text = ' '.join(page for future in futures for page in future.result())
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool next time and read serially now
+            _reset_pool(executor)
+            text = ' '.join(iter_page_text(reader, 0, pages_read))
+    else:
+        text = ' '.join(iter_page_text(reader, 0, pages_read))
+
+    result = (text, pages_read, total_pages)
+    _cache.put(key, result)
+    return result
@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from dedup_index import DuplicateIndex
+from paper_model import SECTION_KINDS, Question, parse_paper
+from storage import connect
+import tracing
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(" ".join(text.split()).lower().encode("utf-8")).hexdigest()
+
+
+class QuestionBank:
+    """SQLite question store keyed by (subject, topic, type, difficulty).
+
+    Lookups go through an index on that key, so no process has to load the
+    whole bank. Usage counters let sampling favour the least recently used
+    questions and spread them across papers.
+    """
+
+    def __init__(self, db_file: str = "question_bank.db", legacy_file: Optional[str] = None):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = connect(db_file)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subject TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                type TEXT NOT NULL,
+                difficulty TEXT NOT NULL DEFAULT '',
+                text TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                answer TEXT,
+                used_count INTEGER NOT NULL DEFAULT 0,
+                last_used REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                UNIQUE (subject, topic, type, difficulty, text_hash)
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(questions)")}
+        if "options" not in columns:
+            # MCQ options, as a JSON list, for banks created before papers were structured
+            self._conn.execute("ALTER TABLE questions ADD COLUMN options TEXT NOT NULL DEFAULT '[]'")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_questions_key "
+            "ON questions(subject, topic, type, difficulty, last_used)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS signatures (question_id INTEGER PRIMARY KEY, signature BLOB NOT NULL)"
+        )
+        self._duplicates = None
+        # Highest question id in the in-memory index; later rows come from other processes
+        self._indexed_upto = 0
+        if legacy_file:
+            self._migrate(legacy_file)
+
+    def _migrate(self, legacy_file: str):
+        """Import the old nested question_bank.json once, keeping only entries that parse as questions"""
+        if not os.path.exists(legacy_file):
+            return
+        with self._lock:
+            done = {row[0] for row in self._conn.execute(
+                "SELECT key FROM meta WHERE key IN ('migrated_from', 'legacy_filtered')"
+            )}
+        if len(done) == 2:
+            return
+        with open(legacy_file, 'r') as f:
+            legacy = json.load(f)
+        entries = [
+            (subject, topic, question_type, entry)
+            for subject, topics in legacy.items()
+            for topic, types in topics.items()
+            for question_type, type_entries in types.items()
+            for entry in type_entries
+        ]
+        if "migrated_from" in done:
+            self._drop_legacy_fragments(entries)
+            return
+        rows = [
+            (subject, topic, question_type, '', question.text, question.options)
+            for subject, topic, question_type, entry in entries
+            for question in self._legacy_questions(question_type, entry)
+        ]
+        self.add_many(rows, meta=("migrated_from", legacy_file))
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_filtered', '1')")
+
+    def _drop_legacy_fragments(self, entries: List[Tuple[str, str, str, str]]):
+        """Remove entries an earlier, unfiltered migration imported verbatim without being questions"""
+        fragments = [
+            (subject, topic, question_type, _text_hash(entry))
+            for subject, topic, question_type, entry in entries
+            if entry.strip() and not self._legacy_questions(question_type, entry)
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for fragment in fragments:
+                    row = self._conn.execute(
+                        "SELECT id FROM questions WHERE subject = ? AND topic = ? AND type = ? "
+                        "AND difficulty = '' AND text_hash = ?", fragment
+                    ).fetchone()
+                    if row:
+                        self._conn.execute("DELETE FROM questions WHERE id = ?", (row['id'],))
+                        self._conn.execute("DELETE FROM signatures WHERE question_id = ?", (row['id'],))
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_filtered', '1')")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _legacy_questions(question_type: str, entry: str) -> List[Question]:
+        """The numbered questions in one legacy entry; code and prose fragments yield none"""
+        title = next((k[2] for k in SECTION_KINDS if k[0] == question_type), SECTION_KINDS[0][2])
+        paper = parse_paper(f"{title}\n{entry}")
+        return [q for s in paper.sections for q in s.questions if q.text]
+
+    @property
+    def duplicates(self) -> DuplicateIndex:
+        """Near-duplicate index over every banked question, loaded on first use"""
+        if self._duplicates is None:
+            with self._lock:
+                if self._duplicates is None:
+                    self._duplicates = self._load_duplicates()
+        return self._duplicates
+
+    @staticmethod
+    def _add_signature_rows(index: DuplicateIndex, rows) -> int:
+        """Add (question_id, signature) rows to index; returns the highest id added, or 0"""
+        if not rows:
+            return 0
+        index.add_signatures(
+            (row['question_id'] for row in rows),
+            np.frombuffer(b"".join(row['signature'] for row in rows), dtype=np.uint32).reshape(len(rows), -1)
+        )
+        return max(row['question_id'] for row in rows)
+
+    def _load_duplicates(self) -> DuplicateIndex:
+        index = DuplicateIndex()
+        rows = self._conn.execute("SELECT question_id, signature FROM signatures").fetchall()
+        self._indexed_upto = self._add_signature_rows(index, rows)
+        # Questions banked before the index existed get their signatures once
+        missing = self._conn.execute(
+            "SELECT id, text FROM questions WHERE id NOT IN (SELECT question_id FROM signatures)"
+        ).fetchall()
+        if missing:
+            signatures = index.hasher.signatures(row['text'] for row in missing)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO signatures (question_id, signature) VALUES (?, ?)",
+                    [(row['id'], signature.tobytes()) for row, signature in zip(missing, signatures)]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            index.add_signatures((row['id'] for row in missing), signatures)
+            self._indexed_upto = max(self._indexed_upto, max(row['id'] for row in missing))
+        return index
+
+    def _catch_up(self, index: DuplicateIndex):
+        """Index questions banked by other processes since the last look; call with self._lock held"""
+        rows = self._conn.execute(
+            "SELECT question_id, signature FROM signatures WHERE question_id > ?", (self._indexed_upto,)
+        ).fetchall()
+        self._indexed_upto = max(self._indexed_upto, self._add_signature_rows(index, rows))
+
+    def add_many(self, rows: Iterable[Tuple], meta: Optional[Tuple[str, str]] = None,
+                 skip_near_duplicates: bool = False) -> int:
+        """Insert (subject, topic, type, difficulty, text[, options]) rows in one transaction; returns rows added.
+
+        With skip_near_duplicates, rows that near-duplicate a banked question
+        (or an earlier row in the same batch) are dropped.
+        """
+        now = time.time()
+        values = [
+            (row[0], row[1], row[2], row[3] or '', row[4].strip(), _text_hash(row[4]),
+             json.dumps(list(row[5]) if len(row) > 5 else []), now)
+            for row in rows
+            if row[4] and row[4].strip()
+        ]
+        with tracing.span("bank.save", rows=len(values)):
+            index = self.duplicates
+            signatures = index.hasher.signatures(value[4] for value in values)
+            batch = DuplicateIndex(hasher=index.hasher)
+
+            added_ids, added_signatures = [], []
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # Under the write lock nobody else can insert, so the index is complete up to our rows
+                    self._catch_up(index)
+                    for position, (value, signature) in enumerate(zip(values, signatures)):
+                        if skip_near_duplicates:
+                            if index.matches(signature) or batch.matches(signature):
+                                continue
+                            batch.add_signatures([position], signature[None, :])
+                        cursor = self._conn.execute(
+                            "INSERT OR IGNORE INTO questions "
+                            "(subject, topic, type, difficulty, text, text_hash, options, created_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            value
+                        )
+                        if cursor.rowcount:
+                            self._conn.execute(
+                                "INSERT OR REPLACE INTO signatures (question_id, signature) VALUES (?, ?)",
+                                (cursor.lastrowid, signature.tobytes())
+                            )
+                            added_ids.append(cursor.lastrowid)
+                            added_signatures.append(signature)
+                    if meta:
+                        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta)
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                if added_ids:
+                    index.add_signatures(added_ids, np.vstack(added_signatures))
+                    self._indexed_upto = max(self._indexed_upto, max(added_ids))
+        return len(added_ids)
+
+    def add(self, subject: str, topic: str, question_type: str, questions: List[Union[str, Question]],
+            difficulty: str = '', skip_near_duplicates: bool = True) -> int:
+        return self.add_many(
+            ((subject, topic, question_type, difficulty, q) if isinstance(q, str)
+             else (subject, topic, question_type, difficulty, q.text, q.options)
+             for q in questions),
+            skip_near_duplicates=skip_near_duplicates
+        )
+
+    def find_near_duplicates(self, texts: List[str]) -> List[Optional[int]]:
+        """For each text, the id of a banked near-duplicate question, or None"""
+        index = self.duplicates
+        with tracing.span("bank.dedup", questions=len(texts)):
+            with self._lock:
+                self._catch_up(index)
+            return [index.find(text) for text in texts]
+
+    @staticmethod
+    def _key_filter(subject: str, topic: str, question_type: str, difficulty: Optional[str]):
+        where = "subject = ? AND topic = ? AND type = ?"
+        params = [subject, topic, question_type]
+        if difficulty is not None:
+            # Questions imported from question_bank.json carry no difficulty ('') and suit any level
+            where += " AND difficulty IN (?, '')"
+            params.append(difficulty)
+        return where, params
+
+    def count(self, subject: str, topic: str, question_type: str, difficulty: Optional[str] = None) -> int:
+        where, params = self._key_filter(subject, topic, question_type, difficulty)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM questions WHERE {where}", params).fetchone()[0]
+
+    def sample(self, subject: str, topic: str, question_type: str, limit: int,
+               difficulty: Optional[str] = None, strategy: str = "lru", mark_used: bool = True) -> List[Dict]:
+        """Pick up to limit questions, least recently used first or at random.
+
+        Picked questions have their usage counters bumped (unless mark_used is
+        False) so the next paper gets different ones. Questions tagged with the
+        requested difficulty come before untagged legacy ones.
+        """
+        where, params = self._key_filter(subject, topic, question_type, difficulty)
+        order = "random()" if strategy == "random" else "last_used, used_count, id"
+        if difficulty:
+            order = "difficulty = '', " + order
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, text, options, answer, used_count FROM questions WHERE {where} ORDER BY {order} LIMIT ?",
+                params + [limit]
+            ).fetchall()
+            if mark_used and rows:
+                now = time.time()
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.executemany(
+                        "UPDATE questions SET used_count = used_count + 1, last_used = ? WHERE id = ?",
+                        [(now, row['id']) for row in rows]
+                    )
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+        return [dict(row, options=json.loads(row['options'] or '[]')) for row in rows]
+
+    def set_answers(self, answers: Dict[int, str]):
+        """Store answers for question ids in one transaction"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE questions SET answer = ? WHERE id = ?",
+                    [(answer, question_id) for question_id, answer in answers.items()]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def set_answers_by_text(self, subject: str, topic: str, question_type: str, difficulty: str,
+                            answers: Dict[str, str]):
+        """Store answers for questions identified by their text under one key"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "UPDATE questions SET answer = ? WHERE subject = ? AND topic = ? AND type = ? "
+                    "AND difficulty = ? AND text_hash = ?",
+                    [(answer, subject, topic, question_type, difficulty or '', _text_hash(text))
+                     for text, answer in answers.items()]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
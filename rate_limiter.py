@@ -0,0 +1,107 @@
+import asyncio
+import os
+import struct
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from storage import FileLock
+
+
+class SlidingWindowLimiter:
+    """Sliding-window log limiter: at most `limit` admissions per `window` seconds.
+
+    Only the last `limit` admission times matter, so they are kept in a ring of
+    fixed size and admission is O(1). With `shared_path` the ring lives in a
+    small file guarded by a file lock, so every worker process on the host
+    draws from the same budget.
+    """
+
+    def __init__(self, limit: int = 50, window: float = 60.0, shared_path: Optional[str] = None):
+        self.limit = limit
+        self.window = window
+        self.shared_path = shared_path
+        self._lock = threading.Lock()
+        self._calls = deque(maxlen=limit)
+        self._file_lock = FileLock(shared_path + ".lock") if shared_path else None
+        self._record = struct.Struct(f"<q{limit}d")
+
+    def try_acquire(self) -> float:
+        """Admit one call if possible; return 0 on success or the seconds to wait"""
+        if self._file_lock:
+            with self._file_lock:
+                return self._try_acquire_shared()
+        with self._lock:
+            now = time.time()
+            if len(self._calls) < self.limit or now - self._calls[0] >= self.window:
+                self._calls.append(now)
+                return 0.0
+            return self._calls[0] + self.window - now
+
+    def _try_acquire_shared(self) -> float:
+        head, slots = self._read_ring()
+        now = time.time()
+        oldest = slots[head]
+        if now - oldest >= self.window:
+            slots[head] = now
+            self._write_ring((head + 1) % self.limit, slots)
+            return 0.0
+        return oldest + self.window - now
+
+    def _read_ring(self):
+        try:
+            with open(self.shared_path, "rb") as f:
+                data = f.read(self._record.size)
+        except FileNotFoundError:
+            data = b""
+        if len(data) != self._record.size:
+            return 0, [0.0] * self.limit
+        values = self._record.unpack(data)
+        return values[0] % self.limit, list(values[1:])
+
+    def _write_ring(self, head: int, slots):
+        tmp_path = self.shared_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._record.pack(head, *slots))
+        os.replace(tmp_path, self.shared_path)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Block until a call is admitted; return False if timeout expires first"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> bool:
+        """Awaitable version of acquire that does not block the event loop"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            # try_acquire can block on the shared file lock, so it runs in a worker thread
+            wait = await asyncio.to_thread(self.try_acquire)
+            if wait <= 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            await asyncio.sleep(wait)
+
+    def available(self) -> bool:
+        """Check whether a call would be admitted right now without consuming it"""
+        now = time.time()
+        if self._file_lock:
+            with self._file_lock:
+                head, slots = self._read_ring()
+            return now - slots[head] >= self.window
+        with self._lock:
+            return len(self._calls) < self.limit or now - self._calls[0] >= self.window
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from storage import connect
+
+
+def _normalize(value: Any) -> Any:
+    """Normalize a requirements value so equivalent inputs hash the same"""
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def make_cache_key(payload: Any, model_name: str, namespace: str = "paper") -> str:
+    """Build a canonical hash for a payload (usually a requirements dict) and model"""
+    canonical = json.dumps(
+        {"namespace": namespace, "model": model_name, "payload": _normalize(payload)},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Disk-backed response cache with TTL and LRU eviction by byte budget.
+
+    The stored byte total is kept as a running figure in the meta table, and
+    a hit only refreshes last_access once it is touch_interval seconds old,
+    so neither lookups nor stores scan or rewrite the whole table.
+    """
+
+    def __init__(self, path: str = "response_cache.db", ttl_seconds: int = 7 * 24 * 3600,
+                 max_bytes: int = 64 * 1024 * 1024, touch_interval: float = 300):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_expires_at ON responses(expires_at) "
+            "WHERE expires_at IS NOT NULL"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        # Caches created before the running total existed are summed once
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM responses"
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for key, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, last_access FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            # Expired entries are left for the next set() to evict
+            if row is None or (row["expires_at"] is not None and row["expires_at"] <= now):
+                self.misses += 1
+                return None
+            if now - row["last_access"] >= self.touch_interval:
+                self._conn.execute(
+                    "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+                )
+            self.hits += 1
+            return row["value"]
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[int] = None):
+        """Store a value, evicting least recently used entries over the byte budget"""
+        now = time.time()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = now + ttl if ttl else None
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                previous = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "(key, value, size, created_at, expires_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, value, size, now, expires_at, now)
+                )
+                self._add_bytes(size - (previous["size"] if previous else 0))
+                self._evict(now)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the oldest entries until under max_bytes"""
+        expired = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+        ).fetchone()[0]
+        if expired:
+            self._conn.execute(
+                "DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            )
+            self._add_bytes(-expired)
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        victims = []
+        freed = 0
+        for row in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            victims.append((row["key"],))
+            freed += row["size"]
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self._add_bytes(-freed)
+
+    def _total_bytes(self) -> int:
+        return self._conn.execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()[0]
+
+    def _add_bytes(self, delta: int):
+        self._conn.execute("UPDATE meta SET value = value + ? WHERE key = 'total_bytes'", (delta,))
+
+    def clear(self):
+        """Remove every cached entry"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.execute("UPDATE meta SET value = 0 WHERE key = 'total_bytes'")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self) -> Dict:
+        """Return hit/miss counters and current cache size"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM responses), "
+                "(SELECT value FROM meta WHERE key = 'total_bytes')"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'entries': row[0],
+            'bytes': row[1]
+        }
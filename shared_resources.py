@@ -0,0 +1,82 @@
+"""Process-wide instances shared by every Streamlit session and rerun.
+
+Streamlit re-executes the page script on every interaction, once per
+browser tab. Building a HistoryManager or re-reading templates.json each
+time costs a file open and a parse per rerun; these accessors hand every
+session the same thread-safe objects instead. File-backed values remember
+the mtime and size of their file and are re-read only when it changes, so
+edits from another process (or a text editor) still show up.
+"""
+import copy
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import streamlit as st
+
+from history_manager import HistoryManager
+from job_queue import JobQueue
+import templates
+
+_UNSET = object()
+
+
+class FileBacked:
+    """A value parsed from a file, re-parsed only after the file changes"""
+
+    def __init__(self, path: str, loader: Callable[[str], Any]):
+        self.path = path
+        self.loader = loader
+        self._value = _UNSET
+        self._signature: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self) -> Any:
+        with self._lock:
+            signature = self._stat()
+            if self._value is _UNSET or signature != self._signature:
+                self._value = self.loader(self.path)
+                # Stat again: the loader may have created the file
+                self._signature = self._stat() if signature is None else signature
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = _UNSET
+
+
+@st.cache_resource(show_spinner=False)
+def get_history_manager(history_file: str = "paper_history.json") -> HistoryManager:
+    """One HistoryManager (and SQLite connection) per history file for the whole process"""
+    return HistoryManager(history_file)
+
+
+@st.cache_resource(show_spinner=False)
+def get_job_queue(db_file: str = "jobs.db") -> JobQueue:
+    """The job queue, opened on first use rather than when the module is imported.
+
+    Its worker starts straight away so jobs queued before a restart are picked up.
+    """
+    queue = JobQueue(db_file)
+    queue.start()
+    return queue
+
+
+_templates = FileBacked(templates.TEMPLATES_FILE, lambda path: templates.load_templates())
+
+
+def get_templates() -> Dict:
+    """Templates from templates.json; a copy, so a session can edit it without affecting others"""
+    return copy.deepcopy(_templates.get())
+
+
+def save_templates(updated: Dict):
+    templates.save_templates(updated)
+    _templates.invalidate()
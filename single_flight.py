@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict
+
+import tracing
+
+
+def prompt_key(prompt: str, json_mode: bool = False) -> str:
+    """Single-flight key for a prompt that has no cache key of its own"""
+    return "prompt:" + hashlib.sha256(f"{int(json_mode)}:{prompt}".encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one.
+
+    The first caller for a key runs the function; callers that arrive while
+    it is in flight wait and receive the same result (or exception). Works
+    for threads (do) and for coroutines on one event loop (do_async), with
+    shared counters of calls made and calls saved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, list] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            tracing.count("single_flight_saved")
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Coroutine version; the shared task is cancelled only once every waiter has gone"""
+        entry = self._tasks.get(key)
+        with self._lock:
+            if entry is None:
+                self.executed += 1
+            else:
+                self.shared += 1
+                tracing.count("single_flight_saved")
+        if entry is None:
+            entry = self._tasks[key] = [asyncio.ensure_future(fn()), 0]
+            entry[0].add_done_callback(lambda _, entry=entry: self._tasks.get(key) is entry and self._tasks.pop(key))
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if entry[1] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.executed + self.shared
+            return {
+                'executed': self.executed,
+                'saved': self.shared,
+                'in_flight': len(self._calls) + len(self._tasks),
+                'saved_ratio': self.shared / total if total else 0
+            }
+
+
+flights = SingleFlight()
@@ -0,0 +1,132 @@
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+# Rough size of a Gemini token in characters; good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it",
+    "of", "on", "or", "the", "to", "with", "will", "this", "that", "their", "its", "using",
+    "unit", "module", "chapter", "topic", "topics", "introduction", "hours", "hrs", "marks"
+}
+
+HEADING_PATTERN = re.compile(r"(?=\b(?:unit|module|chapter|section)\s*[-:]?\s*(?:\d+|[ivx]+)\b)", re.IGNORECASE)
+SENTENCE_PATTERN = re.compile(r"(?<=[.;:!?])\s+|\n+")
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower())
+            if word not in STOPWORDS and len(word) > 1]
+
+
+def split_chunks(text: str, target_words: int = 120) -> List[str]:
+    """Split a syllabus into topic-sized chunks.
+
+    Unit/module/chapter headings start a new chunk; long stretches without
+    headings are cut at sentence boundaries every ~target_words words.
+    Sentences repeated three or more times (page headers, footers, course
+    codes) are treated as boilerplate and dropped; other repeats are kept once.
+    """
+    sections = [part.strip() for part in HEADING_PATTERN.split(text) if part.strip()]
+    sentences_by_section = [
+        [s.strip() for s in SENTENCE_PATTERN.split(section) if s.strip()] for section in sections
+    ]
+
+    counts = Counter(" ".join(s.lower().split()) for sentences in sentences_by_section for s in sentences)
+    seen = set()
+    chunks = []
+    for sentences in sentences_by_section:
+        current, words = [], 0
+        for sentence in sentences:
+            normalized = " ".join(sentence.lower().split())
+            if counts[normalized] >= 3 or normalized in seen:
+                continue
+            seen.add(normalized)
+            current.append(sentence)
+            words += len(sentence.split())
+            if words >= target_words:
+                chunks.append(" ".join(current))
+                current, words = [], 0
+        if current:
+            chunks.append(" ".join(current))
+    return chunks or [text]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of chunks, entirely in memory"""
+
+    def __init__(self, chunks: List[str], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.term_freqs = [Counter(tokenize(chunk)) for chunk in chunks]
+        self.lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        doc_freq = Counter(term for tf in self.term_freqs for term in tf)
+        n = len(chunks)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+    def scores(self, query: str) -> List[float]:
+        terms = [term for term in set(tokenize(query)) if term in self.idf]
+        result = []
+        for tf, length in zip(self.term_freqs, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            result.append(sum(
+                self.idf[term] * tf[term] * (self.k1 + 1) / (tf[term] + norm)
+                for term in terms if term in tf
+            ))
+        return result
+
+
+@lru_cache(maxsize=32)
+def _build_index(syllabus: str) -> BM25Index:
+    return BM25Index(split_chunks(syllabus))
+
+
+@lru_cache(maxsize=256)
+def select_syllabus(syllabus: str, query: str, token_budget: int = 600) -> Tuple[str, Dict]:
+    """Pick the syllabus chunks most relevant to query that fit in token_budget.
+
+    Short syllabi are returned untouched. Selected chunks keep their original
+    order so the prompt still reads like the syllabus. Returns the text and a
+    report with the original, selected and saved token counts.
+    """
+    original_tokens = estimate_tokens(syllabus)
+    if original_tokens <= token_budget:
+        return syllabus, {'original_tokens': original_tokens, 'selected_tokens': original_tokens,
+                          'saved_tokens': 0}
+
+    index = _build_index(syllabus)
+    scores = index.scores(query)
+    # Best match first; ties go to earlier chunks, which usually cover the basics
+    ranked = sorted(range(len(index.chunks)), key=lambda i: (-scores[i], i))
+
+    chosen, used = [], 0
+    for i in ranked:
+        cost = estimate_tokens(index.chunks[i]) + 1
+        if used + cost > token_budget:
+            continue
+        chosen.append(i)
+        used += cost
+
+    if chosen:
+        text = " ".join(index.chunks[i] for i in sorted(chosen))
+    else:
+        # Even the best chunk is over budget: keep its opening instead of nothing
+        text = index.chunks[ranked[0]][:token_budget * CHARS_PER_TOKEN]
+    selected_tokens = estimate_tokens(text)
+    return text, {'original_tokens': original_tokens, 'selected_tokens': selected_tokens,
+                  'saved_tokens': original_tokens - selected_tokens}
+
+
+def strip_paper_preamble(paper: str) -> str:
+    """Drop the exam header and instructions before the first section heading"""
+    match = re.search(r"^.*\bSection\s+A\b", paper, re.MULTILINE | re.IGNORECASE)
+    return paper[match.start():] if match else paper
@@ -1,53 +1,79 @@
+import copy
 import json
 import os
 
-def load_templates():
+from storage import FileLock, atomic_write_json
+
+TEMPLATES_FILE = "templates.json"
+
+DEFAULT_TEMPLATES = {
+    "Mid Exam": {
+        "question_types": {
+            "MCQ": True,
+            "Descriptive": True
+        },
+        "num_mcq": 5,
+        "num_3_marks": 6,
+        "num_5_marks": 5,
+        "total_marks": 50,
+        "selected_option": "Easy",
+        "include_answers": True
+    },
+    "Final Exam": {
+        "question_types": {
+            "MCQ": True,
+            "Descriptive": True
+        },
+        "num_mcq": 10,
+        "num_3_marks": 12,
+        "num_5_marks": 10,
+        "total_marks": 100,
+        "selected_option": "Hard",
+        "include_answers": True
+    }
+}
+
+# Serialises read-modify-write of templates.json across threads and app processes
+_file_lock = FileLock(TEMPLATES_FILE + ".lock")
+
+def _read_templates():
     try:
-        with open("templates.json", "r") as f:
-            templates = json.load(f)
+        with open(TEMPLATES_FILE, "r") as f:
+            return json.load(f)
     except FileNotFoundError:
-        templates = {
-            "Mid Exam": {
-                "question_types": {
-                    "MCQ": True,
-                    "Descriptive": True
-                },
-                "num_mcq": 5,
-                "num_3_marks": 6,
-                "num_5_marks": 5,
-                "total_marks": 50,
-                "selected_option": "Easy",
-                "include_answers": True
-            },
-            "Final Exam": {
-                "question_types": {
-                    "MCQ": True,
-                    "Descriptive": True
-                },
-                "num_mcq": 10,
-                "num_3_marks": 12,
-                "num_5_marks": 10,
-                "total_marks": 100,
-                "selected_option": "Hard",
-                "include_answers": True
-            }
-        }
-        save_templates(templates)
+        return None
+
+def load_templates():
+    templates = _read_templates()
+    if templates is None:
+        with _file_lock:
+            # Another process may have written the defaults while we waited
+            templates = _read_templates()
+            if templates is None:
+                templates = copy.deepcopy(DEFAULT_TEMPLATES)
+                atomic_write_json(TEMPLATES_FILE, templates)
     return templates
 
 def save_templates(templates):
-    with open("templates.json", "w") as f:
-        json.dump(templates, f, indent=4)
+    with _file_lock:
+        atomic_write_json(TEMPLATES_FILE, templates)
 
 def add_template(name, config):
-    templates = load_templates()
-    templates[name] = config
-    save_templates(templates)
+    # Re-read under the lock so a template saved meanwhile by another session is kept
+    with _file_lock:
+        templates = _read_templates()
+        if templates is None:
+            templates = copy.deepcopy(DEFAULT_TEMPLATES)
+        templates[name] = config
+        atomic_write_json(TEMPLATES_FILE, templates)
     return templates
 
 def delete_template(name):
-    templates = load_templates()
-    if name in templates:
-        del templates[name]
-        save_templates(templates)
-    return templates 
\ No newline at end of file
+    with _file_lock:
+        templates = _read_templates()
+        if templates is None:
+            templates = copy.deepcopy(DEFAULT_TEMPLATES)
+        if name in templates:
+            del templates[name]
+            atomic_write_json(TEMPLATES_FILE, templates)
+    return templates
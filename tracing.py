@@ -0,0 +1,265 @@
+"""Lightweight tracing for generations.
+
+A trace covers one request (a paper generation, a batch job, a PDF build);
+spans inside it time the hot path and counters collect token counts, cache
+hits and rate-limiter waits. Finished traces are appended as JSON lines to
+the metrics file, which pages/admin.py summarises. Past METRICS_MAX_BYTES the
+file is rotated to <file>.1, so at most two files' worth is kept on disk.
+
+The current trace lives in a contextvar. asyncio tasks inherit it; work
+handed to thread pools needs bind() to carry it along.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import stat
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+METRICS_FILE = os.environ.get("PAPER_METRICS_FILE", "metrics.jsonl")
+METRICS_MAX_BYTES = int(os.environ.get("PAPER_METRICS_MAX_BYTES", 10 * 1024 * 1024))
+
+# Process-wide switches for the optional per-request captures; the admin page flips them
+settings = {
+    'profile': os.environ.get("PAPER_TRACE_PROFILE", "") == "1",
+    'memory': os.environ.get("PAPER_TRACE_MEMORY", "") == "1",
+}
+
+_current = contextvars.ContextVar("trace", default=None)
+_write_lock = threading.Lock()
+# cProfile and tracemalloc are process-global, so only one request captures at a time
+_capture_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, name: str, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, duration: float, attrs: Dict):
+        with self._lock:
+            self.spans.append({
+                'name': name,
+                'start_ms': round((start - self._start) * 1000, 2),
+                'duration_ms': round(duration * 1000, 2),
+                'thread': threading.current_thread().name,
+                **({'attrs': attrs} if attrs else {})
+            })
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def set_current(current: Optional[Trace]):
+    """Adopt a trace started elsewhere, e.g. at the top of an asyncio task"""
+    _current.set(current)
+
+
+@contextmanager
+def trace(name: str, profile: Optional[bool] = None, memory: Optional[bool] = None, **attrs):
+    """Record a request; nested calls reuse the outer trace as a span"""
+    if _current.get() is not None:
+        with span(name, **attrs):
+            yield _current.get()
+        return
+
+    current = Trace(name, **attrs)
+    token = _current.set(current)
+    profile = settings['profile'] if profile is None else profile
+    memory = settings['memory'] if memory is None else memory
+    capturing = (profile or memory) and _capture_lock.acquire(blocking=False)
+    profiler = None
+    if capturing:
+        if profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if memory:
+            tracemalloc.start()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        duration = time.perf_counter() - current._start
+        _current.reset(token)
+        record = {
+            'trace_id': current.id,
+            'name': name,
+            'started': current.started,
+            'duration_ms': round(duration * 1000, 2),
+            'attrs': current.attrs,
+            'counters': current.counters,
+            'spans': current.spans,
+        }
+        if error:
+            record['error'] = error
+        if capturing:
+            try:
+                if profiler:
+                    profiler.disable()
+                    out = io.StringIO()
+                    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(25)
+                    record['profile'] = out.getvalue()
+                if memory:
+                    snapshot = tracemalloc.take_snapshot()
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    record['memory'] = {
+                        'peak_kb': round(peak / 1024, 1),
+                        'top': [str(stat) for stat in snapshot.statistics("lineno")[:10]]
+                    }
+            finally:
+                _capture_lock.release()
+        write_record(record)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block inside the current trace; free when no trace is active"""
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.add_span(name, start, time.perf_counter() - start, attrs)
+
+
+def count(name: str, value: float = 1):
+    current = _current.get()
+    if current is not None:
+        current.count(name, value)
+
+
+def record_usage(response, prompt: str = "", text: str = ""):
+    """Count prompt/response tokens from Gemini's usage metadata, estimating when it is missing"""
+    from syllabus_index import estimate_tokens
+
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None) if usage else None
+    response_tokens = getattr(usage, "candidates_token_count", None) if usage else None
+    count("prompt_tokens", prompt_tokens if prompt_tokens is not None else estimate_tokens(prompt))
+    count("response_tokens", response_tokens if response_tokens is not None else estimate_tokens(text))
+    count("model_calls")
+
+
+def bind(fn: Callable) -> Callable:
+    """Wrap fn so it records into the caller's trace when run on another thread"""
+    current = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(current)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+def _rotate(path: str, fd: int):
+    """Move a full metrics file aside to path.1, replacing the previous one"""
+    info = os.fstat(fd)
+    if not stat.S_ISREG(info.st_mode) or info.st_size < METRICS_MAX_BYTES:
+        return
+    try:
+        # Another process may have rotated it already; only move the file this record went into
+        if os.stat(path).st_ino == info.st_ino:
+            os.replace(path, path + ".1")
+    except FileNotFoundError:
+        pass
+
+
+def write_record(record: Dict, path: Optional[str] = None):
+    path = path or METRICS_FILE
+    line = (json.dumps(record, default=str) + "\n").encode("utf-8")
+    with _write_lock:
+        try:
+            # One unbuffered O_APPEND write per record, so lines from several processes never interleave
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+                _rotate(path, fd)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"Error writing metrics: {str(e)}")
+
+
+def _tail_lines(path: str, limit: int) -> List[str]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        # Read only the tail; a trace is a few KB at most unless it carries a profile
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - limit * 16384))
+        return f.read().decode("utf-8", errors="replace").splitlines()[-limit:]
+
+
+def load_records(limit: int = 500, path: Optional[str] = None) -> List[Dict]:
+    """The most recent finished traces, oldest first"""
+    path = path or METRICS_FILE
+    lines = _tail_lines(path, limit)
+    if len(lines) < limit:
+        # Just after a rotation the rest are in the previous file
+        lines = _tail_lines(path + ".1", limit - len(lines)) + lines
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return records
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def summarize(records: List[Dict]) -> Dict:
+    """Per-span latency percentiles and counter totals across traces"""
+    spans: Dict[str, List[float]] = {}
+    counters: Dict[str, float] = {}
+    for record in records:
+        spans.setdefault(f"[{record['name']}]", []).append(record['duration_ms'])
+        for s in record.get('spans', []):
+            spans.setdefault(s['name'], []).append(s['duration_ms'])
+        for name, value in record.get('counters', {}).items():
+            counters[name] = counters.get(name, 0) + value
+    return {
+        'traces': len(records),
+        'errors': sum(1 for r in records if r.get('error')),
+        'spans': {
+            name: {
+                'count': len(values),
+                'p50_ms': _percentile(values, 0.5),
+                'p95_ms': _percentile(values, 0.95),
+                'total_ms': round(sum(values), 2)
+            }
+            for name, values in spans.items()
+        },
+        'counters': counters
+    }